@@ -3,8 +3,9 @@ import sys, os
 sys.path.insert(0, "cactus/python/src")
 os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
 
-import json
-from main import generate_hybrid
+import functools, json, subprocess, time
+import main
+from main import generate_hybrid, get_model_pool
 
 
 ############## Tool definitions ##############
@@ -99,256 +100,283 @@ TOOL_SET_TIMER = {
 
 ############## Benchmark cases ##############
 
-BENCHMARKS = [
-    # ===== Easy: 1 tool, direct request =====
-    {
-        "name": "weather_sf",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "What is the weather in San Francisco?"}],
-        "tools": [TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "get_weather", "arguments": {"location": "San Francisco"}}],
-    },
-    {
-        "name": "alarm_10am",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Set an alarm for 10 AM."}],
-        "tools": [TOOL_SET_ALARM],
-        "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 10, "minute": 0}}],
-    },
-    {
-        "name": "message_alice",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Send a message to Alice saying good morning."}],
-        "tools": [TOOL_SEND_MESSAGE],
-        "expected_calls": [{"name": "send_message", "arguments": {"recipient": "Alice", "message": "good morning"}}],
-    },
-    {
-        "name": "weather_london",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "What's the weather like in London?"}],
-        "tools": [TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "get_weather", "arguments": {"location": "London"}}],
-    },
-    {
-        "name": "alarm_6am",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Wake me up at 6 AM."}],
-        "tools": [TOOL_SET_ALARM],
-        "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 6, "minute": 0}}],
-    },
-    {
-        "name": "play_bohemian",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Play Bohemian Rhapsody."}],
-        "tools": [TOOL_PLAY_MUSIC],
-        "expected_calls": [{"name": "play_music", "arguments": {"song": "Bohemian Rhapsody"}}],
-    },
-    {
-        "name": "timer_5min",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Set a timer for 5 minutes."}],
-        "tools": [TOOL_SET_TIMER],
-        "expected_calls": [{"name": "set_timer", "arguments": {"minutes": 5}}],
-    },
-    {
-        "name": "reminder_meeting",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Remind me about the meeting at 3:00 PM."}],
-        "tools": [TOOL_CREATE_REMINDER],
-        "expected_calls": [{"name": "create_reminder", "arguments": {"title": "meeting", "time": "3:00 PM"}}],
-    },
-    {
-        "name": "search_bob",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "Find Bob in my contacts."}],
-        "tools": [TOOL_SEARCH_CONTACTS],
-        "expected_calls": [{"name": "search_contacts", "arguments": {"query": "Bob"}}],
-    },
-    {
-        "name": "weather_paris",
-        "difficulty": "easy",
-        "messages": [{"role": "user", "content": "How's the weather in Paris?"}],
-        "tools": [TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}],
-    },
+def _build_benchmarks():
+    """Benchmark cases, grouped by difficulty."""
+    return [
+        # ===== Easy: 1 tool, direct request =====
+        {
+            "name": "weather_sf",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "What is the weather in San Francisco?"}],
+            "tools": [TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "get_weather", "arguments": {"location": "San Francisco"}}],
+        },
+        {
+            "name": "alarm_10am",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Set an alarm for 10 AM."}],
+            "tools": [TOOL_SET_ALARM],
+            "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 10, "minute": 0}}],
+        },
+        {
+            "name": "message_alice",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Send a message to Alice saying good morning."}],
+            "tools": [TOOL_SEND_MESSAGE],
+            "expected_calls": [{"name": "send_message", "arguments": {"recipient": "Alice", "message": "good morning"}}],
+        },
+        {
+            "name": "weather_london",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "What's the weather like in London?"}],
+            "tools": [TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "get_weather", "arguments": {"location": "London"}}],
+        },
+        {
+            "name": "alarm_6am",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Wake me up at 6 AM."}],
+            "tools": [TOOL_SET_ALARM],
+            "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 6, "minute": 0}}],
+        },
+        {
+            "name": "play_bohemian",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Play Bohemian Rhapsody."}],
+            "tools": [TOOL_PLAY_MUSIC],
+            "expected_calls": [{"name": "play_music", "arguments": {"song": "Bohemian Rhapsody"}}],
+        },
+        {
+            "name": "timer_5min",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Set a timer for 5 minutes."}],
+            "tools": [TOOL_SET_TIMER],
+            "expected_calls": [{"name": "set_timer", "arguments": {"minutes": 5}}],
+        },
+        {
+            "name": "reminder_meeting",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Remind me about the meeting at 3:00 PM."}],
+            "tools": [TOOL_CREATE_REMINDER],
+            "expected_calls": [{"name": "create_reminder", "arguments": {"title": "meeting", "time": "3:00 PM"}}],
+        },
+        {
+            "name": "search_bob",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "Find Bob in my contacts."}],
+            "tools": [TOOL_SEARCH_CONTACTS],
+            "expected_calls": [{"name": "search_contacts", "arguments": {"query": "Bob"}}],
+        },
+        {
+            "name": "weather_paris",
+            "difficulty": "easy",
+            "messages": [{"role": "user", "content": "How's the weather in Paris?"}],
+            "tools": [TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}],
+        },
 
-    # ===== Medium: 2-3 tools, must pick the right one =====
-    {
-        "name": "message_among_three",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Send a message to John saying hello."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_SET_ALARM],
-        "expected_calls": [{"name": "send_message", "arguments": {"recipient": "John", "message": "hello"}}],
-    },
-    {
-        "name": "weather_among_two",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "What's the weather in Tokyo?"}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE],
-        "expected_calls": [{"name": "get_weather", "arguments": {"location": "Tokyo"}}],
-    },
-    {
-        "name": "alarm_among_three",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Set an alarm for 8:15 AM."}],
-        "tools": [TOOL_SEND_MESSAGE, TOOL_SET_ALARM, TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 8, "minute": 15}}],
-    },
-    {
-        "name": "music_among_three",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Play some jazz music."}],
-        "tools": [TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "play_music", "arguments": {"song": "jazz"}}],
-    },
-    {
-        "name": "reminder_among_four",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Remind me to call the dentist at 2:00 PM."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_CREATE_REMINDER, TOOL_SET_ALARM],
-        "expected_calls": [{"name": "create_reminder", "arguments": {"title": "call the dentist", "time": "2:00 PM"}}],
-    },
-    {
-        "name": "timer_among_three",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Set a timer for 10 minutes."}],
-        "tools": [TOOL_SET_ALARM, TOOL_SET_TIMER, TOOL_PLAY_MUSIC],
-        "expected_calls": [{"name": "set_timer", "arguments": {"minutes": 10}}],
-    },
-    {
-        "name": "search_among_four",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Look up Sarah in my contacts."}],
-        "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SEARCH_CONTACTS, TOOL_SET_ALARM],
-        "expected_calls": [{"name": "search_contacts", "arguments": {"query": "Sarah"}}],
-    },
-    {
-        "name": "weather_among_four",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "What's the weather in Berlin?"}],
-        "tools": [TOOL_SEND_MESSAGE, TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER],
-        "expected_calls": [{"name": "get_weather", "arguments": {"location": "Berlin"}}],
-    },
-    {
-        "name": "message_among_four",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Text Dave saying I'll be late."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SET_TIMER, TOOL_SEND_MESSAGE, TOOL_PLAY_MUSIC],
-        "expected_calls": [{"name": "send_message", "arguments": {"recipient": "Dave", "message": "I'll be late"}}],
-    },
-    {
-        "name": "alarm_among_five",
-        "difficulty": "medium",
-        "messages": [{"role": "user", "content": "Set an alarm for 9 AM."}],
-        "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_PLAY_MUSIC, TOOL_SET_TIMER, TOOL_SET_ALARM],
-        "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 9, "minute": 0}}],
-    },
+        # ===== Medium: 2-3 tools, must pick the right one =====
+        {
+            "name": "message_among_three",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Send a message to John saying hello."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_SET_ALARM],
+            "expected_calls": [{"name": "send_message", "arguments": {"recipient": "John", "message": "hello"}}],
+        },
+        {
+            "name": "weather_among_two",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "What's the weather in Tokyo?"}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE],
+            "expected_calls": [{"name": "get_weather", "arguments": {"location": "Tokyo"}}],
+        },
+        {
+            "name": "alarm_among_three",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Set an alarm for 8:15 AM."}],
+            "tools": [TOOL_SEND_MESSAGE, TOOL_SET_ALARM, TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 8, "minute": 15}}],
+        },
+        {
+            "name": "music_among_three",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Play some jazz music."}],
+            "tools": [TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "play_music", "arguments": {"song": "jazz"}}],
+        },
+        {
+            "name": "reminder_among_four",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Remind me to call the dentist at 2:00 PM."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_CREATE_REMINDER, TOOL_SET_ALARM],
+            "expected_calls": [{"name": "create_reminder", "arguments": {"title": "call the dentist", "time": "2:00 PM"}}],
+        },
+        {
+            "name": "timer_among_three",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Set a timer for 10 minutes."}],
+            "tools": [TOOL_SET_ALARM, TOOL_SET_TIMER, TOOL_PLAY_MUSIC],
+            "expected_calls": [{"name": "set_timer", "arguments": {"minutes": 10}}],
+        },
+        {
+            "name": "search_among_four",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Look up Sarah in my contacts."}],
+            "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SEARCH_CONTACTS, TOOL_SET_ALARM],
+            "expected_calls": [{"name": "search_contacts", "arguments": {"query": "Sarah"}}],
+        },
+        {
+            "name": "weather_among_four",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "What's the weather in Berlin?"}],
+            "tools": [TOOL_SEND_MESSAGE, TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER],
+            "expected_calls": [{"name": "get_weather", "arguments": {"location": "Berlin"}}],
+        },
+        {
+            "name": "message_among_four",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Text Dave saying I'll be late."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SET_TIMER, TOOL_SEND_MESSAGE, TOOL_PLAY_MUSIC],
+            "expected_calls": [{"name": "send_message", "arguments": {"recipient": "Dave", "message": "I'll be late"}}],
+        },
+        {
+            "name": "alarm_among_five",
+            "difficulty": "medium",
+            "messages": [{"role": "user", "content": "Set an alarm for 9 AM."}],
+            "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_PLAY_MUSIC, TOOL_SET_TIMER, TOOL_SET_ALARM],
+            "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 9, "minute": 0}}],
+        },
 
-    # ===== Hard: multiple tools needed, multi-call =====
-    {
-        "name": "message_and_weather",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Send a message to Bob saying hi and get the weather in London."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_SET_ALARM],
-        "expected_calls": [
-            {"name": "send_message", "arguments": {"recipient": "Bob", "message": "hi"}},
-            {"name": "get_weather", "arguments": {"location": "London"}},
-        ],
-    },
-    {
-        "name": "alarm_and_weather",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Set an alarm for 7:30 AM and check the weather in New York."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_SEND_MESSAGE],
-        "expected_calls": [
-            {"name": "set_alarm", "arguments": {"hour": 7, "minute": 30}},
-            {"name": "get_weather", "arguments": {"location": "New York"}},
-        ],
-    },
-    {
-        "name": "timer_and_music",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Set a timer for 20 minutes and play lo-fi beats."}],
-        "tools": [TOOL_SET_TIMER, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER, TOOL_SET_ALARM],
-        "expected_calls": [
-            {"name": "set_timer", "arguments": {"minutes": 20}},
-            {"name": "play_music", "arguments": {"song": "lo-fi beats"}},
-        ],
-    },
-    {
-        "name": "reminder_and_message",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Remind me about groceries at 5:00 PM and text Lisa saying see you tonight."}],
-        "tools": [TOOL_CREATE_REMINDER, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM],
-        "expected_calls": [
-            {"name": "create_reminder", "arguments": {"title": "groceries", "time": "5:00 PM"}},
-            {"name": "send_message", "arguments": {"recipient": "Lisa", "message": "see you tonight"}},
-        ],
-    },
-    {
-        "name": "search_and_message",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Find Tom in my contacts and send him a message saying happy birthday."}],
-        "tools": [TOOL_SEARCH_CONTACTS, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_PLAY_MUSIC],
-        "expected_calls": [
-            {"name": "search_contacts", "arguments": {"query": "Tom"}},
-            {"name": "send_message", "arguments": {"recipient": "Tom", "message": "happy birthday"}},
-        ],
-    },
-    {
-        "name": "alarm_and_reminder",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Set an alarm for 6:45 AM and remind me to take medicine at 7:00 AM."}],
-        "tools": [TOOL_SET_ALARM, TOOL_CREATE_REMINDER, TOOL_SEND_MESSAGE, TOOL_PLAY_MUSIC],
-        "expected_calls": [
-            {"name": "set_alarm", "arguments": {"hour": 6, "minute": 45}},
-            {"name": "create_reminder", "arguments": {"title": "take medicine", "time": "7:00 AM"}},
-        ],
-    },
-    {
-        "name": "weather_and_music",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Check the weather in Miami and play summer hits."}],
-        "tools": [TOOL_GET_WEATHER, TOOL_PLAY_MUSIC, TOOL_SET_TIMER, TOOL_SEND_MESSAGE],
-        "expected_calls": [
-            {"name": "get_weather", "arguments": {"location": "Miami"}},
-            {"name": "play_music", "arguments": {"song": "summer hits"}},
-        ],
-    },
-    {
-        "name": "message_weather_alarm",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Text Emma saying good night, check the weather in Chicago, and set an alarm for 5 AM."}],
-        "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_SET_TIMER],
-        "expected_calls": [
-            {"name": "send_message", "arguments": {"recipient": "Emma", "message": "good night"}},
-            {"name": "get_weather", "arguments": {"location": "Chicago"}},
-            {"name": "set_alarm", "arguments": {"hour": 5, "minute": 0}},
-        ],
-    },
-    {
-        "name": "timer_music_reminder",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Set a 15 minute timer, play classical music, and remind me to stretch at 4:00 PM."}],
-        "tools": [TOOL_SET_TIMER, TOOL_PLAY_MUSIC, TOOL_CREATE_REMINDER, TOOL_GET_WEATHER, TOOL_SEND_MESSAGE],
-        "expected_calls": [
-            {"name": "set_timer", "arguments": {"minutes": 15}},
-            {"name": "play_music", "arguments": {"song": "classical music"}},
-            {"name": "create_reminder", "arguments": {"title": "stretch", "time": "4:00 PM"}},
-        ],
-    },
-    {
-        "name": "search_message_weather",
-        "difficulty": "hard",
-        "messages": [{"role": "user", "content": "Look up Jake in my contacts, send him a message saying let's meet, and check the weather in Seattle."}],
-        "tools": [TOOL_SEARCH_CONTACTS, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_PLAY_MUSIC],
-        "expected_calls": [
-            {"name": "search_contacts", "arguments": {"query": "Jake"}},
-            {"name": "send_message", "arguments": {"recipient": "Jake", "message": "let's meet"}},
-            {"name": "get_weather", "arguments": {"location": "Seattle"}},
-        ],
-    },
-]
+        # ===== Hard: multiple tools needed, multi-call =====
+        {
+            "name": "message_and_weather",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Send a message to Bob saying hi and get the weather in London."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SEND_MESSAGE, TOOL_SET_ALARM],
+            "expected_calls": [
+                {"name": "send_message", "arguments": {"recipient": "Bob", "message": "hi"}},
+                {"name": "get_weather", "arguments": {"location": "London"}},
+            ],
+        },
+        {
+            "name": "alarm_and_weather",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Set an alarm for 7:30 AM and check the weather in New York."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_SEND_MESSAGE],
+            "expected_calls": [
+                {"name": "set_alarm", "arguments": {"hour": 7, "minute": 30}},
+                {"name": "get_weather", "arguments": {"location": "New York"}},
+            ],
+        },
+        {
+            "name": "timer_and_music",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Set a timer for 20 minutes and play lo-fi beats."}],
+            "tools": [TOOL_SET_TIMER, TOOL_PLAY_MUSIC, TOOL_GET_WEATHER, TOOL_SET_ALARM],
+            "expected_calls": [
+                {"name": "set_timer", "arguments": {"minutes": 20}},
+                {"name": "play_music", "arguments": {"song": "lo-fi beats"}},
+            ],
+        },
+        {
+            "name": "reminder_and_message",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Remind me about groceries at 5:00 PM and text Lisa saying see you tonight."}],
+            "tools": [TOOL_CREATE_REMINDER, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM],
+            "expected_calls": [
+                {"name": "create_reminder", "arguments": {"title": "groceries", "time": "5:00 PM"}},
+                {"name": "send_message", "arguments": {"recipient": "Lisa", "message": "see you tonight"}},
+            ],
+        },
+        {
+            "name": "search_and_message",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Find Tom in my contacts and send him a message saying happy birthday."}],
+            "tools": [TOOL_SEARCH_CONTACTS, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_PLAY_MUSIC],
+            "expected_calls": [
+                {"name": "search_contacts", "arguments": {"query": "Tom"}},
+                {"name": "send_message", "arguments": {"recipient": "Tom", "message": "happy birthday"}},
+            ],
+        },
+        {
+            "name": "alarm_and_reminder",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Set an alarm for 6:45 AM and remind me to take medicine at 7:00 AM."}],
+            "tools": [TOOL_SET_ALARM, TOOL_CREATE_REMINDER, TOOL_SEND_MESSAGE, TOOL_PLAY_MUSIC],
+            "expected_calls": [
+                {"name": "set_alarm", "arguments": {"hour": 6, "minute": 45}},
+                {"name": "create_reminder", "arguments": {"title": "take medicine", "time": "7:00 AM"}},
+            ],
+        },
+        {
+            "name": "weather_and_music",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Check the weather in Miami and play summer hits."}],
+            "tools": [TOOL_GET_WEATHER, TOOL_PLAY_MUSIC, TOOL_SET_TIMER, TOOL_SEND_MESSAGE],
+            "expected_calls": [
+                {"name": "get_weather", "arguments": {"location": "Miami"}},
+                {"name": "play_music", "arguments": {"song": "summer hits"}},
+            ],
+        },
+        {
+            "name": "message_weather_alarm",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Text Emma saying good night, check the weather in Chicago, and set an alarm for 5 AM."}],
+            "tools": [TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_PLAY_MUSIC, TOOL_SET_TIMER],
+            "expected_calls": [
+                {"name": "send_message", "arguments": {"recipient": "Emma", "message": "good night"}},
+                {"name": "get_weather", "arguments": {"location": "Chicago"}},
+                {"name": "set_alarm", "arguments": {"hour": 5, "minute": 0}},
+            ],
+        },
+        {
+            "name": "timer_music_reminder",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Set a 15 minute timer, play classical music, and remind me to stretch at 4:00 PM."}],
+            "tools": [TOOL_SET_TIMER, TOOL_PLAY_MUSIC, TOOL_CREATE_REMINDER, TOOL_GET_WEATHER, TOOL_SEND_MESSAGE],
+            "expected_calls": [
+                {"name": "set_timer", "arguments": {"minutes": 15}},
+                {"name": "play_music", "arguments": {"song": "classical music"}},
+                {"name": "create_reminder", "arguments": {"title": "stretch", "time": "4:00 PM"}},
+            ],
+        },
+        {
+            "name": "search_message_weather",
+            "difficulty": "hard",
+            "messages": [{"role": "user", "content": "Look up Jake in my contacts, send him a message saying let's meet, and check the weather in Seattle."}],
+            "tools": [TOOL_SEARCH_CONTACTS, TOOL_SEND_MESSAGE, TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_PLAY_MUSIC],
+            "expected_calls": [
+                {"name": "search_contacts", "arguments": {"query": "Jake"}},
+                {"name": "send_message", "arguments": {"recipient": "Jake", "message": "let's meet"}},
+                {"name": "get_weather", "arguments": {"location": "Seattle"}},
+            ],
+        },
+    ]
+
+
+_benchmarks = None
+
+
+def load_benchmarks(path=None):
+    """Build the benchmark cases on first use and return the shared list.
+
+    With path, the shared list becomes the cases of a synth.py corpus instead,
+    read in full: the whole corpus stays in memory for the run.
+    """
+    global _benchmarks
+    if path is not None:
+        from synth import load_cases
+        _benchmarks = list(load_cases(path))
+    elif _benchmarks is None:
+        _benchmarks = _build_benchmarks()
+    return _benchmarks
+
+
+def __getattr__(name):
+    # `from benchmark import BENCHMARKS` keeps working without building the cases at import time.
+    if name == "BENCHMARKS":
+        return load_benchmarks()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _normalize(v):
@@ -395,28 +423,173 @@ def compute_f1(predicted_calls, expected_calls):
     return 2 * precision * recall / (precision + recall)
 
 
-def run_benchmark(benchmarks=None):
-    """Run all benchmark cases and print results."""
+def _percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (pct in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lo = int(rank)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+def _within_budget(generate, budget_ms, messages, tools, confidence_threshold=0.99):
+    """generate under main.latency_budget(budget_ms); a picklable stand-in for _run_case's generate."""
+    with main.latency_budget(budget_ms):
+        return generate(messages, tools, confidence_threshold)
+
+
+def _run_case(case, confidence_threshold=0.99, generate=generate_hybrid):
+    """Run one benchmark case through generate_hybrid (or a stand-in like serve.generate_hybrid) and score it."""
+    start = time.time()
+    result = generate(case["messages"], case["tools"], confidence_threshold)
+    wall_ms = (time.time() - start) * 1000
+    return {
+        "name": case["name"],
+        "difficulty": case["difficulty"],
+        "total_time_ms": result["total_time_ms"],
+        "wall_time_ms": wall_ms,
+        "f1": compute_f1(result["function_calls"], case["expected_calls"]),
+        "source": result.get("source", "unknown"),
+        "deadline_exceeded": result.get("deadline_exceeded", False),
+        "stages": result.get("stages", {}),
+        "predicted": result["function_calls"],
+        "expected": case["expected_calls"],
+    }
+
+
+def use_backend(backend, recordings=None, seed=0, sleep=None, cases=None):
+    """Select the backends generate_hybrid runs on: "cactus" (real), "stub" (offline) or
+    "replay" (the stubs serving a recordings.RecordingStore at `recordings`).
+
+    The stubs sleep out their latencies unless replaying; sleep overrides that.
+    cases are the ones the stubs know answers for: a list, a synth.py corpus
+    path (which also becomes load_benchmarks()), or by default the benchmark cases.
+    """
+    if isinstance(cases, str):
+        cases = load_benchmarks(cases)
+    if backend not in ("stub", "replay"):
+        return
+    from stub_backend import StubCloudBackend, StubLocalBackend, answers_from_cases, load_recordings
+    answers = answers_from_cases(cases if cases is not None else load_benchmarks())
+    if sleep is None:
+        sleep = backend == "stub"
+    if backend == "replay":
+        from recordings import RecordingStore
+        recorded = RecordingStore(recordings)
+    else:
+        recorded = load_recordings(recordings) if recordings else None
+    main.set_backends(
+        local=StubLocalBackend(answers, recordings=recorded, seed=seed, sleep=sleep),
+        cloud=StubCloudBackend(answers, recordings=recorded, seed=seed, sleep=sleep),
+    )
+
+
+def record_to(path):
+    """Wrap the installed backends so every raw response is captured; returns the RecordingStore.
+
+    Responses already recorded at path are kept; call store.save() when done.
+    """
+    from recordings import RecordingCloudBackend, RecordingLocalBackend, RecordingStore
+    store = RecordingStore(path)
+    main.set_backends(local=RecordingLocalBackend(main.get_local_backend(), store),
+                      cloud=RecordingCloudBackend(main.get_cloud_backend(), store))
+    return store
+
+
+def _warmup(cases, pool_size, backend=None):
+    """Load the model pool and run a few untimed cases so first-call costs stay out of the results."""
+    if backend is not None:
+        use_backend(*backend)
+    get_model_pool(pool_size).warmup()
+    for case in cases:
+        generate_hybrid(case["messages"], case["tools"])
+    # Warmup answers must not turn into cache hits for the timed run.
+    main.response_cache.clear()
+    main.get_cloud_dispatcher().clear_recent()
+
+
+def run_benchmark(benchmarks=None, workers=1, executor="thread", warmup=0, backend=None, trace=None, record=None,
+                  server=None, latency_budget=None):
+    """Run all benchmark cases and print results.
+
+    With workers > 1 cases run concurrently on a thread pool sharing one model
+    pool of that size, or on a process pool where each worker loads its own.
+    The first `warmup` cases are run once beforehand and excluded from timing.
+    backend is an optional use_backend() argument tuple, e.g. ("stub",).
+    trace is an optional path the timed cases' stage spans are exported to
+    (see main.export_traces); process workers keep their traces to themselves.
+    record is an optional path every raw backend response is saved to (see
+    recordings.py); it needs the in-process executor.
+    server is an optional serve.py socket path: cases are sent to that daemon
+    from `workers` client threads instead of running here, and the daemon's
+    own counters are reported.
+    latency_budget gives each case that many milliseconds (main.latency_budget,
+    or the daemon's deadline_ms with server).
+    """
     if benchmarks is None:
-        benchmarks = BENCHMARKS
+        benchmarks = load_benchmarks()
 
     total = len(benchmarks)
-    results = []
-    for i, case in enumerate(benchmarks, 1):
-        print(f"[{i}/{total}] Running: {case['name']} ({case['difficulty']})...", end=" ", flush=True)
-        result = generate_hybrid(case["messages"], case["tools"])
-        f1 = compute_f1(result["function_calls"], case["expected_calls"])
-        source = result.get("source", "unknown")
-        print(f"F1={f1:.2f} | {result['total_time_ms']:.0f}ms | {source}")
-        results.append({
-            "name": case["name"],
-            "difficulty": case["difficulty"],
-            "total_time_ms": result["total_time_ms"],
-            "f1": f1,
-            "source": source,
-            "predicted": result["function_calls"],
-            "expected": case["expected_calls"],
-        })
+    warmup_cases = benchmarks[:warmup]
+    results = [None] * total
+    if backend is not None:
+        use_backend(*backend)
+    if record and executor == "process" and workers > 1:
+        raise ValueError("recording needs the thread executor")
+    store = record_to(record) if record else None
+    client = None
+    if server:
+        if executor == "process" or record or trace:
+            raise ValueError("--server runs cases on the daemon; it takes neither --executor process, --record nor --trace")
+        from serve import HybridClient
+        client = HybridClient(server)
+        warmup_cases = []
+    generate = client.generate_hybrid if client is not None else generate_hybrid
+    if latency_budget is not None:
+        if client is not None:
+            generate = functools.partial(client.generate_hybrid, deadline_ms=latency_budget)
+        else:
+            generate = functools.partial(_within_budget, generate, latency_budget)
+
+    if workers <= 1:
+        if warmup_cases:
+            _warmup(warmup_cases, 1)
+        exporter = main.export_traces(trace) if trace else None
+        start = time.time()
+        for i, case in enumerate(benchmarks, 1):
+            print(f"[{i}/{total}] Running: {case['name']} ({case['difficulty']})...", end=" ", flush=True)
+            r = _run_case(case, generate=generate)
+            print(f"F1={r['f1']:.2f} | {r['total_time_ms']:.0f}ms | {r['source']}")
+            results[i - 1] = r
+    else:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+        if executor == "process":
+            pool = ProcessPoolExecutor(workers, initializer=_warmup, initargs=(warmup_cases, 1, backend))
+        else:
+            if client is None:
+                _warmup(warmup_cases, workers)
+            pool = ThreadPoolExecutor(workers)
+        exporter = main.export_traces(trace) if trace and executor != "process" else None
+        with pool:
+            if executor == "process":
+                # Spin the workers up (running their warmup initializer) before the clock starts.
+                list(pool.map(time.sleep, [0] * workers))
+            start = time.time()
+            futures = {pool.submit(_run_case, case, 0.99, generate): i for i, case in enumerate(benchmarks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                r = future.result()
+                results[futures[future]] = r
+                print(f"[{done}/{total}] {r['name']} ({r['difficulty']}) F1={r['f1']:.2f} | {r['total_time_ms']:.0f}ms | {r['source']}")
+    elapsed = time.time() - start
+    if exporter is not None:
+        main.remove_trace_hook(exporter)
+        exporter.close()
+        print(f"\nStage traces written to {trace}")
+    if store is not None:
+        store.save()
+        print(f"\n{len(store)} responses recorded to {record}")
 
     print("\n=== Benchmark Results ===\n")
     print(f"  {'#':>2} | {'Difficulty':<10} | {'Name':<28} | {'Time (ms)':>10} | {'F1':>5} | Source")
@@ -443,6 +616,36 @@ def run_benchmark(benchmarks=None):
     print(f"  {'overall':<8} avg F1={avg_f1:.2f}  avg time={avg_time:.2f}ms  total time={total_time:.2f}ms")
     print(f"           on-device={on_device_total}/{len(results)} ({100*on_device_total/len(results):.0f}%)  cloud={cloud_total}/{len(results)} ({100*cloud_total/len(results):.0f}%)")
 
+    print(f"\n--- Latency percentiles (ms) ---")
+    for difficulty in ["easy", "medium", "hard", "overall"]:
+        group = results if difficulty == "overall" else [r for r in results if r["difficulty"] == difficulty]
+        if not group:
+            continue
+        times = [r["total_time_ms"] for r in group]
+        print(f"  {difficulty:<8} p50={_percentile(times, 50):.2f}  p90={_percentile(times, 90):.2f}  "
+              f"p99={_percentile(times, 99):.2f}  max={max(times):.2f}")
+    if latency_budget is not None:
+        late = sum(r["deadline_exceeded"] for r in results)
+        print(f"  budget {latency_budget:.0f}ms: over budget={sum(r['wall_time_ms'] > latency_budget for r in results)}  "
+              f"cut short={late}")
+    print_stage_breakdown(results)
+    print(f"  throughput={len(results) / elapsed:.2f} req/s  wall={elapsed * 1000:.0f}ms  workers={workers} ({executor})")
+    if client is not None:
+        stats = client.stats()
+        print(f"  daemon: served={stats['served']}  rejected={stats['rejected']}  expired={stats['expired']}  failed={stats['failed']}")
+        print(f"  response cache: exact hits={stats['cache']['hits']['exact']}  semantic hits={stats['cache']['hits']['semantic']}  misses={stats['cache']['misses']}")
+        print(f"  prefix cache: hits={stats['pool']['prefix_hits']}  misses={stats['pool']['prefix_misses']}")
+    elif executor != "process" or workers <= 1:
+        stats = main.response_cache.stats()
+        print(f"  response cache: exact hits={stats['hits']['exact']}  semantic hits={stats['hits']['semantic']}  misses={stats['misses']}")
+        pool = get_model_pool().stats
+        print(f"  prefix cache: hits={pool['prefix_hits']}  misses={pool['prefix_misses']}")
+        cloud = main.get_cloud_dispatcher().stats
+        print(f"  cloud dispatcher: calls={cloud['calls']}  coalesced={cloud['coalesced']}  rejected={cloud['rejected']}")
+        replayed = getattr(main.get_local_backend(), "recordings", None)
+        if hasattr(replayed, "lookup"):
+            print(f"  replay: exact={replayed.stats['hits']}  approximate={replayed.stats['approximate']}  missed={replayed.stats['misses']}")
+
     # Total score
     score = compute_total_score(results)
     print(f"\n{'='*50}")
@@ -452,6 +655,84 @@ def run_benchmark(benchmarks=None):
     return results
 
 
+def print_stage_breakdown(results):
+    """Average milliseconds per pipeline stage for each difficulty, from generate_hybrid's trace."""
+    stage_names = sorted({name for r in results for name in r.get("stages", {})})
+    if not stage_names:
+        return
+    print(f"\n--- Stage breakdown (avg ms per request) ---")
+    print(f"  {'stage':<16}" + "".join(f"{d:>10}" for d in ["easy", "medium", "hard", "overall"]))
+    for name in stage_names:
+        row = f"  {name:<16}"
+        for difficulty in ["easy", "medium", "hard", "overall"]:
+            group = results if difficulty == "overall" else [r for r in results if r["difficulty"] == difficulty]
+            avg = sum(r.get("stages", {}).get(name, 0.0) for r in group) / len(group) if group else 0.0
+            row += f"{avg:>10.2f}"
+        print(row)
+    print()
+
+
+def run_voice_benchmark(fixtures_dir, benchmarks=None, workers=1, backend=None, chunk_ms=500):
+    """Audio-to-function-call latency on WAV fixtures named <case name>.wav.
+
+    Each fixture is played in real time through voice.voice_to_action twice:
+    streaming (routing starts on partial transcripts) and sequential (transcribe
+    once the audio ends, then route). Latency runs from the end of the audio to
+    the tool calls. Cases without a fixture are skipped.
+    """
+    import voice
+    from concurrent.futures import ThreadPoolExecutor
+    if benchmarks is None:
+        benchmarks = load_benchmarks()
+    if backend is not None:
+        use_backend(*backend)
+    cases = [(c, os.path.join(fixtures_dir, f"{c['name']}.wav")) for c in benchmarks]
+    cases = [(c, path) for c, path in cases if os.path.exists(path)]
+    if not cases:
+        print(f"No fixtures found in {fixtures_dir}")
+        return {}
+    get_model_pool(workers).warmup()
+    voice.get_whisper_pool(workers).warmup()
+
+    def run(item, stream):
+        case, path = item
+        result = voice.voice_to_action(path, case["tools"], chunk_ms=chunk_ms, stream=stream)
+        return {
+            "name": case["name"],
+            "difficulty": case["difficulty"],
+            "latency_ms": result["latency_ms"],
+            "f1": compute_f1(result["function_calls"], case["expected_calls"]),
+            "source": result.get("source", "unknown"),
+            "speculated": result["speculated"],
+            "transcript_ok": main.normalize_query(result["transcript"])
+                             == main.normalize_query(main._last_user_text(case["messages"])),
+        }
+
+    runs = {}
+    for mode, stream in (("streaming", True), ("sequential", False)):
+        main.response_cache.clear()
+        main.get_cloud_dispatcher().clear_recent()
+        print(f"Running {len(cases)} voice cases ({mode}, workers={workers})...", flush=True)
+        with ThreadPoolExecutor(workers) as pool:
+            runs[mode] = list(pool.map(lambda item: run(item, stream), cases))
+
+    print(f"\n=== Voice Benchmark (audio end -> tool calls) ===\n")
+    print(f"  {'Name':<28} | {'streaming ms':>12} | {'sequential ms':>13} | {'F1':>4} | Source")
+    for s, q in zip(runs["streaming"], runs["sequential"]):
+        flag = "*" if s["speculated"] else " "
+        print(f"  {s['name']:<28} | {s['latency_ms']:>11.0f}{flag} | {q['latency_ms']:>13.0f} | {s['f1']:>4.2f} | {s['source']}")
+    print("  (* routed on a partial transcript)")
+    for mode, results in runs.items():
+        latencies = [r["latency_ms"] for r in results]
+        print(f"\n  {mode:<10} avg={sum(latencies) / len(latencies):.0f}ms  p50={_percentile(latencies, 50):.0f}ms  "
+              f"p90={_percentile(latencies, 90):.0f}ms  avg F1={sum(r['f1'] for r in results) / len(results):.2f}  "
+              f"on-device={sum(r['source'] == 'on-device' for r in results)}/{len(results)}  "
+              f"transcripts exact={sum(r['transcript_ok'] for r in results)}/{len(results)}")
+    speculated = sum(r["speculated"] for r in runs["streaming"])
+    print(f"  streaming routed on a partial for {speculated}/{len(cases)} cases")
+    return runs
+
+
 def compute_total_score(results):
     """
     Compute a total score from 0-100% as a weighted sum across difficulty levels.
@@ -487,5 +768,67 @@ def compute_total_score(results):
     return total_score * 100
 
 
+def check_import_time(modules=("main", "benchmark"), budget_ms=50.0):
+    """Measure cold import time of each module in a fresh interpreter against a budget.
+
+    Uses `python -X importtime`, so the numbers exclude interpreter startup.
+    Returns True if every module imports within budget_ms.
+    """
+    ok = True
+    for module in modules:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            print(f"  {module:<12} import failed:\n{proc.stderr.strip().splitlines()[-1]}")
+            ok = False
+            continue
+        cumulative_us = 0
+        for line in proc.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative_us = int(fields[1])
+        took_ms = cumulative_us / 1000
+        within = took_ms <= budget_ms
+        ok = ok and within
+        print(f"  {module:<12} import {took_ms:7.2f}ms  (budget {budget_ms:.0f}ms)  {'OK' if within else 'OVER BUDGET'}")
+    return ok
+
+
 if __name__ == "__main__":
-    run_benchmark()
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the hybrid tool-calling benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="Number of cases to run concurrently")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="Worker pool type when --workers > 1")
+    parser.add_argument("--warmup", type=int, default=0, help="Untimed cases to run before measuring")
+    parser.add_argument("--backend", choices=["cactus", "stub"], default="cactus",
+                        help="stub runs offline on deterministic stand-ins for Cactus and Gemini")
+    parser.add_argument("--record", metavar="PATH", help="Save every raw Cactus/Gemini response to PATH (.jsonl or .jsonl.gz)")
+    parser.add_argument("--replay", metavar="PATH", help="Replay responses recorded with --record instead of running models")
+    parser.add_argument("--recordings", help="JSONL of recorded outputs for the stub backend to replay")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the stub backend's latency/confidence draws")
+    parser.add_argument("--cases", metavar="PATH", help="Run the cases of a corpus generated by synth.py instead of the built-in ones")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="Export per-stage spans: JSONL if PATH ends in .jsonl, else a Chrome trace (thread executor only)")
+    parser.add_argument("--voice", metavar="DIR",
+                        help="Measure audio-to-function-call latency on DIR/<case name>.wav fixtures (see voice.py)")
+    parser.add_argument("--server", metavar="SOCKET", nargs="?", const=os.environ.get("HYBRID_SOCKET", "/tmp/cactus-hybrid.sock"),
+                        help="Send cases to a running serve.py daemon (default socket: $HYBRID_SOCKET) instead of running them here")
+    parser.add_argument("--latency-budget", type=float, metavar="MS",
+                        help="Give every case MS milliseconds (main.latency_budget) and report how many overran")
+    parser.add_argument("--check-import-time", type=float, metavar="BUDGET_MS", nargs="?", const=50.0,
+                        help="Only check that main/benchmark import within budget (default 50ms) and exit")
+    args = parser.parse_args()
+    if args.check_import_time is not None:
+        sys.exit(0 if check_import_time(budget_ms=args.check_import_time) else 1)
+    backend = ("replay", args.replay, args.seed) if args.replay else (args.backend, args.recordings, args.seed)
+    if args.cases:
+        # Process workers load the corpus again for their stubs' answers.
+        load_benchmarks(args.cases)
+        backend += (None, args.cases)
+    if args.voice:
+        run_voice_benchmark(args.voice, workers=args.workers, backend=backend)
+        sys.exit(0)
+    run_benchmark(workers=args.workers, executor=args.executor, warmup=args.warmup,
+                  backend=None if args.server else backend, trace=args.trace, record=args.record, server=args.server,
+                  latency_budget=args.latency_budget)
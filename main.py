@@ -3,53 +3,1313 @@ import sys
 sys.path.insert(0, "cactus/python/src")
 functiongemma_path = "cactus/weights/functiongemma-270m-it"
 
-import json, os, time
-from cactus import cactus_init, cactus_complete, cactus_destroy
-from google import genai
-from google.genai import types
+import atexit, contextvars, copy, difflib, hashlib, itertools, json, math, os, re, threading, time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
+# The cactus bindings (native library) and google-genai (a large import tree) are
+# loaded on first use, so importing this module stays cheap for CLI runs, worker
+# processes and stub backends that never touch them.
+_cactus = None
+_genai = None
 
-def generate_cactus(messages, tools):
-    """Run function calling on-device via FunctionGemma + Cactus."""
-    model = cactus_init(functiongemma_path)
 
-    cactus_tools = [{
-        "type": "function",
-        "function": t,
-    } for t in tools]
+def _cactus_lib():
+    global _cactus
+    if _cactus is None:
+        import cactus
+        _cactus = cactus
+    return _cactus
 
-    raw_str = cactus_complete(
-        model,
-        [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + messages,
-        tools=cactus_tools,
-        force_tools=True,
-        max_tokens=256,
-        stop_sequences=["<|im_end|>", "<end_of_turn>"],
-    )
 
-    cactus_destroy(model)
+def _genai_lib():
+    """Return (genai, types) from google-genai, importing it on first call."""
+    global _genai
+    if _genai is None:
+        from google import genai
+        from google.genai import types
+        _genai = (genai, types)
+    return _genai
 
+
+# Routing knobs read by generate_hybrid; override in place, e.g. CONFIG["speculate"] = False.
+CONFIG = {
+    # Start the cloud request alongside local generation when a fallback looks likely.
+    "speculate": True,
+    # Minimum pre-score (estimated fallback probability) before we pay for a speculative cloud call.
+    "speculate_min_prior": 0.5,
+    # Upper bound on speculative cloud requests in flight at once.
+    "speculate_max_inflight": 4,
+    # How local results are accepted: "learned" (RoutingModel from router.json, or "threshold" until
+    # train_router.py has written one) or "threshold" (confidence >= confidence_threshold).
+    "router": "learned",
+    # Gemini model used for cloud fallback.
+    "cloud_model": "gemini-2.0-flash",
+    # Threads for cloud backends that only offer a blocking generate().
+    "cloud_workers": 8,
+    # Gemini requests allowed in flight at once across all callers.
+    "cloud_max_concurrency": 8,
+    # Callers allowed to queue for a cloud slot before new ones are rejected.
+    "cloud_max_pending": 64,
+    # Seconds a queued caller waits for a cloud slot before giving up.
+    "cloud_queue_timeout_s": 30.0,
+    # A finished cloud result is shared with identical requests arriving within this window.
+    "cloud_coalesce_window_ms": 50.0,
+    # Resolve trivial single-intent requests with schema-derived patterns, no model at all.
+    "fast_path": True,
+    # Split multi-intent messages into single-intent sub-queries for the local model.
+    "decompose": True,
+    # Catalogs with more tools than this are narrowed by ToolIndex before local generation.
+    "tool_filter_min_tools": 12,
+    # Tools kept per intent in the user message when narrowing.
+    "tool_filter_top_k": 4,
+    # Token limit for one local generation.
+    "max_tokens": 256,
+    # Cap each generation at token_budget() instead, and hand off to cloud if it runs out without a valid call.
+    "token_budget": True,
+    # Headroom multiplier on the estimated length of the expected calls.
+    "token_budget_slack": 1.5,
+    # Smallest budget ever given, whatever the estimate.
+    "token_budget_min": 32,
+    # Cactus tool RAG: tools it keeps per query (0 = all); None leaves the cactus default.
+    # Ignored when ToolIndex has already narrowed the catalog.
+    "tool_rag_top_k": None,
+    # Cactus's own cloud_handoff confidence cut; None leaves the cactus default.
+    "cactus_confidence_threshold": None,
+    # Sampling temperature for local generation; None leaves the cactus default.
+    "temperature": None,
+    # Parse tool calls from the token stream and stop decoding as soon as the answer is settled.
+    "stream": True,
+    # Non-call text (ignoring FunctionGemma's markers) tolerated before a stream is declared malformed.
+    "stream_max_junk_chars": 24,
+    # Keep each pooled handle's KV cache for the system prompt + tool block and route same-tool-set requests to it.
+    # Relies on cactus_complete keeping only the cached tokens the new prompt shares (see ModelPool);
+    # turn off if a cactus build appends to a dirty cache instead.
+    "prefix_cache": True,
+    # Serve repeated requests from response_cache.
+    "cache": True,
+    # Cosine similarity above which a cached answer for a reworded query is reused; None = exact match only.
+    "cache_semantic_threshold": None,
+    # Percentile of the rolling latency estimates that requests with a latency_budget plan with.
+    "deadline_percentile": 90,
+    # Samples an estimator needs before its percentile is trusted over its prior.
+    "deadline_min_samples": 8,
+}
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with a fixed capacity."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def tool_set_key(tools):
+    """Stable hash of a tool schema list; identical catalogs map to the same key."""
+    blob = json.dumps(tools, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+_current_trace = contextvars.ContextVar("hybrid_trace", default=None)
+_trace_hooks = []
+
+
+class Trace:
+    """Timed stages of one top-level call.
+
+    Spans are {"stage", "start", "duration_ms", "thread"} plus optional "attrs".
+    They overlap when sub-queries run concurrently, and prefill/decode (reported
+    by cactus) sit inside the inference span that measured them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.spans = []
+
+    def add(self, stage, start, duration_ms, **attrs):
+        span = {"stage": stage, "start": start, "duration_ms": duration_ms, "thread": threading.current_thread().name}
+        if attrs:
+            span["attrs"] = attrs
+        self.spans.append(span)
+
+    def stages(self):
+        """Total milliseconds per stage, summed over overlapping spans."""
+        totals = {}
+        for span in self.spans:
+            totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["duration_ms"]
+        return totals
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start,
+                "duration_ms": ((self.end or time.time()) - self.start) * 1000, "spans": self.spans}
+
+
+@contextmanager
+def tracing(name):
+    """Collect stage timings for the calls made inside.
+
+    Yields a new Trace, which is handed to every trace hook on exit, or None
+    when already inside a trace, whose spans the inner calls then join.
+    """
+    if _current_trace.get() is not None:
+        yield None
+        return
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.end = time.time()
+        for hook in list(_trace_hooks):
+            hook(trace)
+
+
+@contextmanager
+def stage(name, **attrs):
+    """Time the enclosed block as one span of the current trace; free when not tracing."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.time()
     try:
-        raw = json.loads(raw_str)
-    except json.JSONDecodeError:
+        yield
+    finally:
+        trace.add(name, start, (time.time() - start) * 1000, **attrs)
+
+
+def record_stage(name, start, duration_ms, **attrs):
+    """Add a span measured elsewhere (e.g. prefill time reported by cactus) to the current trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration_ms, **attrs)
+
+
+def add_trace_hook(hook):
+    """Call hook(trace) after every generate_hybrid/generate_cloud/generate_cactus call."""
+    _trace_hooks.append(hook)
+
+
+def remove_trace_hook(hook):
+    if hook in _trace_hooks:
+        _trace_hooks.remove(hook)
+
+
+class JsonlTraceExporter:
+    """Trace hook appending one JSON line per call to path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        line = json.dumps(trace.to_dict(), default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    def close(self):
+        pass
+
+
+class ChromeTraceExporter:
+    """Trace hook collecting spans as Chrome trace events, for chrome://tracing or Perfetto.
+
+    Events are kept in memory and written to path by close(), which also runs at exit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def __call__(self, trace):
+        with self._lock:
+            for span in trace.spans:
+                tid = self._threads.get(span["thread"])
+                if tid is None:
+                    tid = self._threads[span["thread"]] = len(self._threads) + 1
+                    self._events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                                         "args": {"name": span["thread"]}})
+                self._events.append({
+                    "name": span["stage"], "cat": trace.name, "ph": "X", "pid": os.getpid(), "tid": tid,
+                    "ts": span["start"] * 1e6, "dur": span["duration_ms"] * 1000, "args": span.get("attrs", {}),
+                })
+
+    def close(self):
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, f)
+
+
+def export_traces(path):
+    """Install an exporter for every subsequent call: JSONL if path ends in .jsonl, Chrome trace JSON otherwise."""
+    exporter = JsonlTraceExporter(path) if path.endswith(".jsonl") else ChromeTraceExporter(path)
+    add_trace_hook(exporter)
+    return exporter
+
+
+_latency_budget = contextvars.ContextVar("hybrid_latency_budget", default=None)
+_deadline = contextvars.ContextVar("hybrid_deadline", default=None)
+
+
+@contextmanager
+def latency_budget(ms):
+    """Give every generate_hybrid call made inside the block ms milliseconds to answer.
+
+    The budget rides along in a context variable, so generate_hybrid's
+    signature is unchanged; None lifts an enclosing budget. Within budget the
+    router picks the path its latency estimates expect to finish in time, caps
+    and stops local decoding at the deadline, and returns the local answer
+    (marked "deadline_exceeded") rather than wait on a cloud call past it.
+    """
+    token = _latency_budget.set(ms)
+    try:
+        yield
+    finally:
+        _latency_budget.reset(token)
+
+
+def remaining_ms():
+    """Milliseconds left before the current request's deadline, or None if it has none."""
+    deadline = _deadline.get()
+    return None if deadline is None else (deadline - time.time()) * 1000
+
+
+class LatencyEstimator:
+    """Rolling latency of one path: an EWMA of the mean and percentiles over the last `window` samples."""
+
+    def __init__(self, prior_ms, alpha=0.2, window=256):
+        self.prior_ms = prior_ms
+        self.alpha = alpha
+        self.mean = None
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        with self._lock:
+            self.mean = ms if self.mean is None else self.mean + self.alpha * (ms - self.mean)
+            self._samples.append(ms)
+
+    def percentile(self, q):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        rank = (len(ordered) - 1) * q / 100
+        lo = int(rank)
+        hi = min(lo + 1, len(ordered) - 1)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+    def estimate(self):
+        """What a deadline-bound request plans with: the configured percentile, or the prior until warmed up."""
+        if len(self._samples) < CONFIG["deadline_min_samples"]:
+            return self.prior_ms if self.mean is None else max(self.prior_ms, self.mean)
+        # Recent drift (e.g. a slower network) shows in the EWMA before the window catches up.
+        return max(self.percentile(CONFIG["deadline_percentile"]), self.mean)
+
+    def typical(self):
+        """The EWMA, or the prior before any sample; for costs summed over many draws, like per-token decode time."""
+        return self.prior_ms if self.mean is None else self.mean
+
+    def stats(self):
+        return {"samples": len(self._samples), "ewma_ms": self.mean, "p50_ms": self.percentile(50),
+                "p90_ms": self.percentile(90), "p99_ms": self.percentile(99)}
+
+
+# Observed by every generation and cloud call; read when a request has a latency budget.
+latency_estimators = {
+    "local": LatencyEstimator(200.0),         # one generate_cactus call
+    "prefill": LatencyEstimator(40.0),        # time to first token
+    "decode_token": LatencyEstimator(5.0),    # per decoded token
+    "cloud": LatencyEstimator(600.0),         # one cloud call, queueing included
+}
+
+
+class CactusBackend:
+    """Local backend: the handle-based cactus Python bindings."""
+
+    def init(self, model_path):
+        return _cactus_lib().cactus_init(model_path)
+
+    def complete(self, model, messages, **options):
+        return _cactus_lib().cactus_complete(model, messages, **options)
+
+    def reset(self, model):
+        _cactus_lib().cactus_reset(model)
+
+    def stop(self, model):
+        _cactus_lib().cactus_stop(model)
+
+    def destroy(self, model):
+        _cactus_lib().cactus_destroy(model)
+
+    def embed(self, model, text, normalize=False):
+        return _cactus_lib().cactus_embed(model, text, normalize)
+
+    def transcribe(self, model, audio_path, prompt=""):
+        return _cactus_lib().cactus_transcribe(model, audio_path, prompt=prompt)
+
+
+class GeminiBackend:
+    """Cloud backend: Gemini function calling via google-genai."""
+
+    def _request(self, messages, tools):
+        _, types = _genai_lib()
+        system, contents = self._contents(messages)
         return {
-            "function_calls": [],
-            "total_time_ms": 0,
-            "confidence": 0,
+            "model": CONFIG["cloud_model"],
+            "contents": contents,
+            "config": types.GenerateContentConfig(tools=gemini_tools_for(tools), system_instruction=system),
         }
 
-    return {
+    @staticmethod
+    def _contents(messages):
+        """System instruction and Gemini contents for a chat history.
+
+        Assistant turns become model turns carrying their text and
+        function_calls; consecutive tool turns become one turn of function
+        responses, named after the calls they answer if they carry no name.
+        """
+        _, types = _genai_lib()
+        system, contents, pending = [], [], []
+        for m in messages:
+            role = m["role"]
+            if role == "system":
+                system.append(m["content"])
+                continue
+            if role in ("assistant", "model"):
+                calls = m.get("function_calls") or []
+                parts = [types.Part(text=m["content"])] if m.get("content") else []
+                parts += [types.Part(function_call=types.FunctionCall(name=c["name"], args=c.get("arguments", {})))
+                          for c in calls]
+                pending = [c["name"] for c in calls]
+                contents.append(types.Content(role="model", parts=parts))
+            elif role in ("tool", "function"):
+                response = m.get("content")
+                if isinstance(response, str):
+                    try:
+                        response = json.loads(response)
+                    except json.JSONDecodeError:
+                        pass
+                if not isinstance(response, dict):
+                    response = {"result": response}
+                name = m.get("name") or (pending.pop(0) if pending else "")
+                part = types.Part.from_function_response(name=name, response=response)
+                if contents and contents[-1].role == "tool":
+                    contents[-1].parts.append(part)
+                else:
+                    contents.append(types.Content(role="tool", parts=[part]))
+            else:
+                contents.append(types.Content(role="user", parts=[types.Part(text=str(m.get("content", "")))]))
+        return "\n\n".join(system) or None, contents
+
+    def generate(self, messages, tools):
+        with stage("cloud_serialize"):
+            request = self._request(messages, tools)
+        start_time = time.time()
+        with stage("cloud_network"):
+            gemini_response = get_cloud_client().models.generate_content(**request)
+        with stage("cloud_parse"):
+            return self._parse(gemini_response, (time.time() - start_time) * 1000)
+
+    async def generate_async(self, messages, tools):
+        """Same as generate, on the SDK's asyncio client; cancelling the task aborts the request."""
+        with stage("cloud_serialize"):
+            request = self._request(messages, tools)
+        start_time = time.time()
+        with stage("cloud_network"):
+            gemini_response = await get_cloud_client().aio.models.generate_content(**request)
+        with stage("cloud_parse"):
+            return self._parse(gemini_response, (time.time() - start_time) * 1000)
+
+    @staticmethod
+    def _parse(gemini_response, total_time_ms):
+        function_calls = []
+        for candidate in gemini_response.candidates:
+            for part in candidate.content.parts:
+                if part.function_call:
+                    function_calls.append({
+                        "name": part.function_call.name,
+                        "arguments": dict(part.function_call.args),
+                    })
+
+        return {
+            "function_calls": function_calls,
+            "total_time_ms": total_time_ms,
+        }
+
+
+_backends = {"local": CactusBackend(), "cloud": GeminiBackend()}
+
+
+def set_backends(local=None, cloud=None):
+    """Install alternative local/cloud backends (e.g. stub_backend's offline stubs).
+
+    A local backend implements init/complete/reset/stop/destroy/embed/transcribe
+    with the cactus_* semantics; a cloud backend implements generate(messages, tools)
+    returning {"function_calls", "total_time_ms"}, and optionally an awaitable
+    generate_async with the same contract. Call before the model pool is first used.
+    """
+    if local is not None:
+        _backends["local"] = local
+    if cloud is not None:
+        _backends["cloud"] = cloud
+
+
+def get_local_backend():
+    return _backends["local"]
+
+
+def get_cloud_backend():
+    return _backends["cloud"]
+
+
+_UNKNOWN_PREFIX = object()
+
+
+def prefix_key(system_prompt, tools):
+    """Key for the prompt prefix a handle's KV cache holds: the system prompt and the tool block."""
+    return hashlib.sha1(system_prompt.encode()).hexdigest()[:12] + tool_set_key(tools)
+
+
+def _shares_prompt(held, prefix):
+    """True if two prefix keys, conversation-scoped or not, start with the same system prompt and tool block."""
+    return (isinstance(held, str) and prefix is not None
+            and held.rpartition("|")[2] == prefix.rpartition("|")[2])
+
+
+class ModelPool:
+    """Process-wide pool of FunctionGemma handles, loaded lazily and reused across calls.
+
+    A handle released with a prefix key keeps its KV cache, and acquire(prefix=key)
+    prefers an idle handle that already holds that prefix, so cactus only has to
+    prefill what follows it. Failing that, one holding the same system prompt
+    and tool block for another conversation (see Session) is kept as is.
+    Otherwise the least recently used idle handle is reset and handed out,
+    which evicts the prefix it held.
+
+    A kept cache also holds the previous request's user turn and output, not just
+    the prefix. Reuse assumes cactus_complete matches the new prompt against the
+    cached tokens, keeps the longest common prefix and re-prefills from the first
+    token that differs, so those stale tokens are dropped. stub_backend models
+    exactly that; the saving it reports has not been measured on device, and
+    CONFIG["prefix_cache"] = False falls back to resetting every handle.
+    """
+
+    def __init__(self, model_path, size=1):
+        self.model_path = model_path
+        self.size = max(1, size)
+        self._idle = []  # least recently released first
+        self._prefixes = {}  # id(handle) -> prefix key its KV cache holds, None if clean
+        self._handles = []
+        self._loading = 0
+        self._available = threading.Condition()
+        self.stats = {"prefix_hits": 0, "prefix_misses": 0}
+
+    def acquire(self, timeout=None, prefix=None):
+        """Take an idle handle, loading a new one if the pool is not yet full.
+
+        The handle comes back clean unless it already holds `prefix`.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._available:
+            while not self._idle and len(self._handles) + self._loading >= self.size:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no FunctionGemma handle free after {timeout}s")
+                self._available.wait(remaining)
+            if self._idle:
+                model = self._take(prefix)
+                held = self._prefixes[id(model)]
+                stale = held not in (None, prefix) and not _shares_prompt(held, prefix)
+                if stale:
+                    self._prefixes[id(model)] = None
+            else:
+                self._loading += 1
+                model = held = None
+            if prefix is not None:
+                self.stats["prefix_hits" if _shares_prompt(held, prefix) else "prefix_misses"] += 1
+
+        if model is not None:
+            if stale:
+                get_local_backend().reset(model)
+            return model
+        try:
+            with stage("model_init"):
+                model = get_local_backend().init(self.model_path)
+        finally:
+            with self._available:
+                self._loading -= 1
+                if model is not None:
+                    self._handles.append(model)
+                    self._prefixes[id(model)] = None
+                self._available.notify()
+        return model
+
+    def _take(self, prefix):
+        if prefix is not None:
+            def rank(i):
+                # Exact prefix, then the same prompt outside any conversation, then a
+                # clean handle, before taking over another conversation's; most
+                # recently released first, except that evictions go oldest first.
+                held = self._prefixes[id(self._idle[i])]
+                if held == prefix:
+                    return 0, -i
+                if _shares_prompt(held, prefix):
+                    return (1, -i) if "|" not in held else (3, -i)
+                return (2, -i) if held is None else (4, i)
+
+            return self._idle.pop(min(range(len(self._idle)), key=rank))
+        # Prefix-free work (embeddings, prefix caching off) takes a clean handle
+        # if there is one, so warm prefixes survive it.
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._prefixes[id(self._idle[i])] is None:
+                return self._idle.pop(i)
+        return self._idle.pop(0)
+
+    def release(self, model, reset=True, prefix=None):
+        """Return a handle to the pool, clearing its KV cache unless told otherwise.
+
+        With reset=False, prefix names what the KV cache now starts with so
+        later acquires can reuse it; without one the handle is reset on reuse.
+        """
+        if reset:
+            get_local_backend().reset(model)
+        with self._available:
+            if reset:
+                self._prefixes[id(model)] = None
+            else:
+                self._prefixes[id(model)] = _UNKNOWN_PREFIX if prefix is None else prefix
+            self._idle.append(model)
+            self._available.notify()
+
+    @contextmanager
+    def handle(self, timeout=None, prefix=None):
+        """A pooled handle for the block; with prefix, its KV cache is kept for the next caller."""
+        model = self.acquire(timeout, prefix)
+        try:
+            yield model
+        except BaseException:
+            self.release(model)
+            raise
+        self.release(model, reset=prefix is None, prefix=prefix)
+
+    def evict(self, match):
+        """Reset every idle handle whose KV cache holds a prefix key match(key) accepts; returns how many."""
+        with self._available:
+            stale = [m for m in self._idle if isinstance(self._prefixes[id(m)], str) and match(self._prefixes[id(m)])]
+            # Out of the idle list while resetting, so nobody is handed one mid-reset.
+            self._idle = [m for m in self._idle if m not in stale]
+        for model in stale:
+            self.release(model)
+        return len(stale)
+
+    def warmup(self, n=None):
+        """Eagerly load up to n handles (default: the full pool)."""
+        models = [self.acquire() for _ in range(min(n or self.size, self.size))]
+        with self._available:
+            self._idle.extend(models)
+            self._available.notify_all()
+
+    def close(self):
+        """Destroy every handle the pool has loaded."""
+        with self._available:
+            handles, self._handles = self._handles, []
+            self._idle = []
+            self._prefixes = {}
+        for model in handles:
+            get_local_backend().destroy(model)
+
+
+_model_pool = None
+_model_pool_lock = threading.Lock()
+
+
+def get_model_pool(size=None):
+    """Return the shared FunctionGemma pool, creating it on first use.
+
+    The pool size defaults to $CACTUS_POOL_SIZE (1 if unset); passing a larger
+    size later grows the existing pool so concurrent callers get their own handle.
+    """
+    global _model_pool
+    with _model_pool_lock:
+        if _model_pool is None:
+            _model_pool = ModelPool(functiongemma_path, size or int(os.environ.get("CACTUS_POOL_SIZE", "1")))
+            atexit.register(_model_pool.close)
+        elif size and size > _model_pool.size:
+            _model_pool.size = size
+        return _model_pool
+
+
+_session = contextvars.ContextVar("hybrid_session", default=None)
+_session_ids = itertools.count(1)
+
+
+class Session:
+    """One conversation whose turns go back to the pooled handle that served the last one.
+
+    That handle keeps its KV cache between turns, so cactus prefills only the
+    messages added since; close() resets whichever handles still hold it.
+    stats counts local generations and the prompt tokens they prefilled.
+    """
+
+    def __init__(self):
+        self.key = f"session-{next(_session_ids)}|"
+        self.stats = {"generations": 0, "prefill_tokens": 0}
+        self._lock = threading.Lock()
+
+    def prefix_key(self, system_prompt, tools):
+        return self.key + prefix_key(system_prompt, tools)
+
+    def record(self, prefill_tokens):
+        with self._lock:
+            self.stats["generations"] += 1
+            self.stats["prefill_tokens"] += prefill_tokens or 0
+
+    def close(self):
+        get_model_pool().evict(lambda key: key.startswith(self.key))
+
+
+@contextmanager
+def conversation():
+    """Run the block's generate_hybrid/generate_cactus calls as turns of one conversation.
+
+    Pass each turn the whole history, with earlier answers as
+    {"role": "assistant", "function_calls": [...]} and tool output as
+    {"role": "tool", "name": ..., "content": ...}; the cloud sees it as
+    structured turns. Yields the Session, which is closed on exit.
+    """
+    session = Session()
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+        session.close()
+
+
+def embed_text(text):
+    """Unit-length FunctionGemma embedding of text, computed on a pooled handle."""
+    with get_model_pool().handle() as model:
+        return get_local_backend().embed(model, text, True)
+
+
+def _cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _stems(text):
+    """Crude stems (first five letters) so "remind" matches "create_reminder"."""
+    return {w[:5] for w in re.findall(r"[a-z]+", text.lower()) if len(w) > 2}
+
+
+class ToolIndex:
+    """Embedding index over one tool catalog, for picking the tools relevant to a query."""
+
+    def __init__(self, tools):
+        self.tools = tools
+        self.vectors = [embed_text(self._describe(t)) for t in tools]
+        self.words = [_stems(t["name"]) for t in tools]
+
+    @staticmethod
+    def _describe(tool):
+        params = ", ".join(tool["parameters"].get("properties", {}))
+        return f"{tool['name'].replace('_', ' ')}: {tool['description']} ({params})"
+
+    def select(self, query, k):
+        """Top-k tools for query, returned in catalog order so the prompt prefix stays stable."""
+        if k >= len(self.tools):
+            return list(self.tools)
+        vector = embed_text(query)
+        query_words = _stems(query)
+        # A tool-name word in the query ("alarm", "weather") is a strong signal
+        # that plain embedding similarity can under-rate.
+        scores = [_cosine(vector, v) + 0.1 * len(words & query_words) for v, words in zip(self.vectors, self.words)]
+        keep = sorted(sorted(range(len(self.tools)), key=lambda i: -scores[i])[:k])
+        return [self.tools[i] for i in keep]
+
+
+_tool_indexes = LRUCache(maxsize=16)
+
+
+def tool_index_for(tools):
+    """ToolIndex for a catalog, built once per tool_set_key."""
+    key = tool_set_key(tools)
+    index = _tool_indexes.get(key)
+    if index is None:
+        index = ToolIndex(tools)
+        _tool_indexes.put(key, index)
+    return index
+
+
+def select_tools(messages, tools):
+    """Narrow large catalogs to the tools relevant to the last user turn; small ones pass through."""
+    if len(tools) <= CONFIG["tool_filter_min_tools"]:
+        return tools
+    text = _last_user_text(messages)
+    return tool_index_for(tools).select(text, CONFIG["tool_filter_top_k"] * _count_intents(text))
+
+
+_CALL_MARKERS = re.compile(r"<start_function_call>|<end_function_call>|<start_function_response>|\s")
+_ESCAPE = "<escape>"
+
+
+def _parse_value(raw, schema):
+    """Convert an unescaped FunctionGemma argument literal using the parameter's schema type."""
+    kind = schema.get("type", "string")
+    try:
+        if kind == "integer":
+            return int(float(raw))
+        if kind == "number":
+            return float(raw)
+    except ValueError:
+        return raw
+    if kind == "boolean":
+        return raw.strip().lower() == "true"
+    return raw
+
+
+class StreamingCallParser:
+    """Incremental parser for FunctionGemma's `call:name{key:<escape>value<escape>,...}` output.
+
+    Fed token by token; after each feed, `calls` holds every completed call and
+    `status` is "partial" while the text can still become a valid call set,
+    "complete" once `expected` calls have been emitted and pass (or can be
+    repaired to pass) the tool schemas, or "malformed" as soon as they cannot:
+    free text, a tool name that matches nothing, or a finished call set the
+    validator rejects. Start/end markers are optional, since special tokens
+    may reach the callback as empty strings.
+    """
+
+    def __init__(self, tools, expected=1):
+        self.tools = {t["name"]: t for t in tools}
+        self.validator = validator_for(tools)
+        self.expected = expected
+        self.text = ""
+        self.calls = []
+        self.status = "partial"
+
+    def feed(self, token):
+        if isinstance(token, bytes):
+            token = token.decode("utf-8", "ignore")
+        self.text += token
+        self.calls, self.status = self._parse()
+        return self.status
+
+    def _junk(self, text):
+        return len(_CALL_MARKERS.sub("", text)) > CONFIG["stream_max_junk_chars"]
+
+    def _parse(self):
+        text, calls, i = self.text, [], 0
+        while True:
+            j = text.find("call:", i)
+            if j < 0:
+                return calls, "malformed" if self._junk(text[i:]) else self._settled(calls)
+            if self._junk(text[i:j]):
+                return calls, "malformed"
+            k = j + len("call:")
+            brace = text.find("{", k)
+            name = text[k:] if brace < 0 else text[k:brace]
+            if brace < 0:
+                return calls, "partial" if re.fullmatch(r"[\w.-]*", name) else "malformed"
+            resolved = self.validator.resolve_tool(name.strip())
+            if resolved is None:
+                return calls, "malformed"
+            args, end = self._parse_args(text, brace + 1, self.tools[resolved])
+            if args is None:
+                return calls, "malformed"
+            if end < 0:
+                return calls, "partial"
+            calls.append({"name": name.strip(), "arguments": args})
+            i = end
+
+    def _settled(self, calls):
+        if len(calls) < self.expected:
+            return "partial"
+        return "complete" if self.validator.repair_all(calls)[1] else "malformed"
+
+    def _parse_args(self, text, pos, tool):
+        """Parse `key:value,...}` from pos; returns (args, end) with end=-1 if unterminated, args=None if invalid."""
+        properties = tool["parameters"].get("properties", {})
+        args = {}
+        while pos < len(text):
+            colon = text.find(":", pos)
+            if colon < 0:
+                key = text[pos:].strip().lstrip(",").strip()
+                return args, (pos + text[pos:].find("}") + 1 if key.startswith("}") else -1)
+            key = text[pos:colon].strip().lstrip(",").strip()
+            if key.startswith("}"):
+                return args, pos + text[pos:].find("}") + 1
+            if not re.fullmatch(r"[\w.-]+", key):
+                return None, -1
+            pos = colon + 1
+            if text.startswith(_ESCAPE, pos):
+                close = text.find(_ESCAPE, pos + len(_ESCAPE))
+                if close < 0:
+                    return args, -1
+                value = text[pos + len(_ESCAPE):close]
+                pos = close + len(_ESCAPE)
+            else:
+                stop = min([p for p in (text.find(",", pos), text.find("}", pos)) if p >= 0], default=-1)
+                if stop < 0:
+                    return args, -1
+                value = text[pos:stop].strip()
+                pos = stop
+            args[key] = _parse_value(value, properties.get(key, {}))
+            rest = text[pos:].lstrip()
+            if rest.startswith("}"):
+                return args, len(text) - len(rest) + 1
+            if rest.startswith(","):
+                pos = len(text) - len(rest) + 1
+            elif rest:
+                return None, -1
+        return args, -1
+
+
+_JSON_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool}
+_TIME_VALUE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*(?:([ap])\.?m\.?)?\s*$", re.IGNORECASE)
+
+
+def _type_ok(value, kind):
+    expected = _JSON_TYPES.get(kind)
+    if expected is None:
+        return True
+    if isinstance(value, bool):
+        return expected is bool
+    return isinstance(value, expected)
+
+
+def _coerce(value, kind):
+    """Cheap deterministic conversion of value to a JSON-schema type; None if it cannot be done safely."""
+    if _type_ok(value, kind):
+        # Only surrounding whitespace: a trailing period may belong to the value ("Washington D.C.").
+        return value.strip() if kind == "string" and isinstance(value, str) else value
+    if kind == "integer":
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and re.fullmatch(r"\s*-?\d+(?:\.0*)?\s*", value):
+            return int(float(value))
+    elif kind == "number" and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    elif kind == "boolean" and isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    elif kind == "string" and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+class ToolValidator:
+    """Precompiled schema checks and repairs for one tool set.
+
+    repair() fixes what can be fixed deterministically: tool and argument names
+    via case/fuzzy matching, scalar types via coercion, and clock strings such
+    as "7:30 AM" given to integer hour/minute parameters. Calls that still fail
+    validate() are left for the caller to escalate.
+    """
+
+    def __init__(self, tools):
+        self.tools = {}
+        for t in tools:
+            params = t["parameters"]
+            properties = {k: v.get("type", "string") for k, v in params.get("properties", {}).items()}
+            self.tools[t["name"]] = (properties, params.get("required", []))
+        self._folded = {self._fold(n): n for n in self.tools}
+
+    @staticmethod
+    def _fold(name):
+        return re.sub(r"[^a-z0-9]", "", name.lower())
+
+    def _match_name(self, name, candidates, folded):
+        if name in candidates:
+            return name
+        if self._fold(name) in folded:
+            return folded[self._fold(name)]
+        close = difflib.get_close_matches(name, list(candidates), n=1, cutoff=0.75)
+        return close[0] if close else None
+
+    def resolve_tool(self, name):
+        """Canonical tool name for a possibly misspelled one, or None."""
+        return self._match_name(name, self.tools, self._folded)
+
+    def validate(self, call):
+        """True if call names a known tool, uses only its parameters, has every required one, and types match."""
+        spec = self.tools.get(call.get("name"))
+        if spec is None:
+            return False
+        properties, required = spec
+        args = call.get("arguments", {})
+        if any(r not in args for r in required):
+            return False
+        return all(k in properties and _type_ok(v, properties[k]) for k, v in args.items())
+
+    def repair(self, call):
+        """Return (repaired call or None if unrepairable, list of repairs applied)."""
+        repairs = []
+        name = self.resolve_tool(call.get("name", ""))
+        if name is None:
+            return None, repairs
+        if name != call.get("name"):
+            repairs.append(f"name {call.get('name')!r} -> {name!r}")
+        properties, required = self.tools[name]
+        folded_props = {self._fold(k): k for k in properties}
+
+        args = {}
+        for key, value in (call.get("arguments") or {}).items():
+            target = self._match_name(key, properties, folded_props)
+            if target is None:
+                repairs.append(f"dropped argument {key!r}")
+                continue
+            if target != key:
+                repairs.append(f"argument {key!r} -> {target!r}")
+            args[target] = value
+
+        hour_key = next((k for k in properties if "hour" in k.lower() and properties[k] == "integer"), None)
+        minute_key = next((k for k in properties if "minute" in k.lower() and properties[k] == "integer"), None)
+        clock = _TIME_VALUE.match(args[hour_key]) if hour_key and isinstance(args.get(hour_key), str) else None
+        if clock and (clock.group(2) or clock.group(3)):
+            meridiem = (clock.group(3) or "a").lower()
+            if meridiem == "a":  # PM would need a 12h/24h guess; leave it unrepaired
+                args[hour_key] = int(clock.group(1))
+                if minute_key and clock.group(2) is not None and minute_key not in args:
+                    args[minute_key] = int(clock.group(2))
+                repairs.append(f"parsed clock time into {hour_key!r}")
+        if hour_key and minute_key and hour_key in args and minute_key not in args and minute_key in required:
+            args[minute_key] = 0
+            repairs.append(f"defaulted {minute_key!r} to 0")
+
+        for key, value in list(args.items()):
+            fixed = _coerce(value, properties[key])
+            if fixed is None:
+                return None, repairs
+            if fixed != value or type(fixed) is not type(value):
+                repairs.append(f"coerced {key!r}")
+                args[key] = fixed
+
+        repaired = {"name": name, "arguments": args}
+        return (repaired if self.validate(repaired) else None), repairs
+
+    def repair_all(self, calls):
+        """Repair every call; returns (calls, all_valid, repairs), keeping unrepairable calls as-is."""
+        out, repairs, ok = [], [], True
+        for call in calls:
+            fixed, applied = self.repair(call)
+            repairs.extend(applied)
+            if fixed is None:
+                ok = False
+                out.append(call)
+            else:
+                out.append(fixed)
+        return out, ok, repairs
+
+
+_validators = LRUCache(maxsize=32)
+
+
+def validator_for(tools):
+    """ToolValidator for a tool set, compiled once per tool_set_key."""
+    key = tool_set_key(tools)
+    validator = _validators.get(key)
+    if validator is None:
+        validator = ToolValidator(tools)
+        _validators.put(key, validator)
+    return validator
+
+
+def validate_call(call, tools):
+    """True if call is valid against the schema of its tool in tools."""
+    return validator_for(tools).validate(call)
+
+
+def _call_tokens(tool, text):
+    """Rough FunctionGemma token count of one call to tool, at about four characters a token.
+
+    String arguments are taken from the user text, so their length is bounded by it.
+    """
+    tokens = 4 + len(tool["name"]) // 4  # call markers, "call:", braces
+    for name, spec in tool["parameters"].get("properties", {}).items():
+        value = len(text) // 4 + 1 if spec.get("type") == "string" else 2
+        tokens += 3 + len(name) // 4 + value  # two <escape>s and a separator
+    return tokens
+
+
+def token_budget(messages, tools):
+    """max_tokens for one local generation: the costliest call in the catalog once per intent, with slack."""
+    text = _last_user_text(messages)
+    per_call = max((_call_tokens(t, text) for t in tools), default=0)
+    budget = math.ceil(per_call * _count_intents(text) * CONFIG["token_budget_slack"])
+    return min(CONFIG["max_tokens"], max(CONFIG["token_budget_min"], budget))
+
+
+class LocalRun:
+    """Handle on one in-progress generate_cactus call, so another thread can stop it."""
+
+    def __init__(self):
+        self.model = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def attach(self, model):
+        with self._lock:
+            self.model = model
+            cancelled = self.cancelled
+        if cancelled:
+            get_local_backend().stop(model)
+
+    def detach(self):
+        # Must happen before the handle goes back to the pool, or a late
+        # cancel() would stop someone else's generation.
+        with self._lock:
+            self.model = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            model = self.model
+        if model is not None:
+            get_local_backend().stop(model)
+
+
+def generate_cactus(messages, tools, control=None):
+    """Run function calling on-device via FunctionGemma + Cactus.
+
+    control is an optional LocalRun through which the call can be cancelled.
+
+    With CONFIG["stream"], tool calls are parsed as tokens arrive and decoding
+    stops early once the expected calls are complete and schema-valid, or once
+    the output is malformed (reported as confidence 0 so the router hands off).
+    """
+    with tracing("generate_cactus") as trace:
+        result = _generate_cactus(messages, tools, control)
+    if trace is not None:
+        result["stages"] = trace.stages()
+    return result
+
+
+def _cactus_messages(messages):
+    """History as FunctionGemma sees it: earlier calls in its own output format, tool output as JSON text.
+
+    Rendering calls the way the model wrote them keeps a session's KV cache,
+    which holds the generated tokens, a prefix of the next turn's prompt.
+    """
+    out = []
+    for m in messages:
+        if m.get("function_calls"):
+            calls = "".join(
+                "<start_function_call>call:" + c["name"] + "{"
+                + ",".join(f"{k}:{_ESCAPE}{v}{_ESCAPE}" for k, v in c.get("arguments", {}).items())
+                + "}<end_function_call>" for c in m["function_calls"])
+            m = {"role": m["role"], "content": (m.get("content") or "") + calls}
+        elif not isinstance(m.get("content"), str):
+            m = dict(m, content=json.dumps(m.get("content")))
+        out.append(m)
+    return out
+
+
+def _generate_cactus(messages, tools, control):
+    start_time = time.time()
+    with stage("tool_select"):
+        selected = select_tools(messages, tools)
+    select_ms = (time.time() - start_time) * 1000 if selected is not tools else 0
+
+    with stage("prompt_build"):
+        cactus_tools = [{
+            "type": "function",
+            "function": t,
+        } for t in selected]
+        prompt = [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + _cactus_messages(messages)
+
+    options = {}
+    for option, knob in (("tool_rag_top_k", "tool_rag_top_k"), ("confidence_threshold", "cactus_confidence_threshold"),
+                         ("temperature", "temperature")):
+        if CONFIG[knob] is not None:
+            options[option] = CONFIG[knob]
+    if selected is not tools:
+        # Already narrowed; don't let Cactus's own tool RAG drop more.
+        options["tool_rag_top_k"] = 0
+
+    max_tokens = token_budget(messages, selected) if CONFIG["token_budget"] else CONFIG["max_tokens"]
+    deadline = _deadline.get()
+    capped = False
+    if deadline is not None:
+        # Decode no more tokens than are expected to fit before the deadline.
+        left_ms = (deadline - time.time()) * 1000 - latency_estimators["prefill"].estimate()
+        fits = max(1, int(left_ms / latency_estimators["decode_token"].typical()))
+        capped = fits < max_tokens
+        max_tokens = min(max_tokens, fits)
+
+    backend = get_local_backend()
+    parser = None
+    overran = False
+    pool = get_model_pool()
+    session = _session.get()
+    if session is not None:
+        prefix = session.prefix_key(prompt[0]["content"], selected)
+    else:
+        prefix = prefix_key(prompt[0]["content"], selected) if CONFIG["prefix_cache"] else None
+    with stage("model_acquire"):
+        model = pool.acquire(prefix=prefix)
+    ok = False
+    try:
+        if CONFIG["stream"]:
+            parser = StreamingCallParser(selected, _count_intents(_last_user_text(messages)))
+        if parser is not None or deadline is not None:
+
+            def on_token(token, token_id, user_data):
+                nonlocal overran
+                if overran or parser is not None and parser.status != "partial":
+                    return
+                if parser is not None and parser.feed(token) != "partial":
+                    backend.stop(model)
+                elif deadline is not None and time.time() >= deadline:
+                    overran = True
+                    backend.stop(model)
+
+            options["callback"] = on_token
+
+        if control is not None:
+            control.attach(model)
+        inference_start = time.time()
+        try:
+            with stage("inference"):
+                raw_str = backend.complete(
+                    model,
+                    prompt,
+                    tools=cactus_tools,
+                    force_tools=True,
+                    max_tokens=max_tokens,
+                    stop_sequences=["<|im_end|>", "<end_of_turn>"],
+                    **options,
+                )
+            ok = True
+        finally:
+            if control is not None:
+                control.detach()
+    finally:
+        # The KV cache now starts with the system prompt and tool block; keep it
+        # for the next request with this tool set unless generation failed. What
+        # follows the prefix (this user turn and output) is left for cactus to
+        # trim against the next prompt; see ModelPool.
+        if ok and prefix is not None:
+            pool.release(model, reset=False, prefix=prefix)
+        else:
+            pool.release(model)
+
+    with stage("parse"):
+        try:
+            raw = json.loads(raw_str)
+        except json.JSONDecodeError:
+            raw = {}
+    if session is not None:
+        session.record(raw.get("prefill_tokens"))
+    ttft_ms = raw.get("time_to_first_token_ms", 0)
+    decode_tokens = raw.get("decode_tokens", 0)
+    if ttft_ms:
+        decode_ms = max(0.0, raw.get("total_time_ms", 0) - ttft_ms)
+        record_stage("prefill", inference_start, ttft_ms, tokens=raw.get("prefill_tokens"))
+        record_stage("decode", inference_start + ttft_ms / 1000, decode_ms, tokens=decode_tokens)
+        latency_estimators["prefill"].observe(ttft_ms)
+        if decode_tokens:
+            latency_estimators["decode_token"].observe(decode_ms / decode_tokens)
+    if capped and decode_tokens >= max_tokens and (parser is None or parser.status == "partial"):
+        overran = True
+
+    result = {
         "function_calls": raw.get("function_calls", []),
-        "total_time_ms": raw.get("total_time_ms", 0),
+        "total_time_ms": raw.get("total_time_ms", 0) + select_ms,
         "confidence": raw.get("confidence", 0),
     }
+    if overran:
+        # Stopped for the deadline with the answer unfinished: keep the calls
+        # completed so far, but leave it to the router to trust them.
+        result["deadline_exceeded"] = True
+        result["function_calls"] = parser.calls if parser is not None else []
+        result["confidence"] = 0
+    elif parser is not None and parser.status != "partial":
+        # Cactus was stopped mid-generation, so its own parse of the truncated
+        # output is unreliable; use what the stream parser saw instead.
+        result["early_exit"] = parser.status
+        if parser.status == "complete":
+            result["function_calls"] = parser.calls
+        else:
+            result["function_calls"] = []
+            result["confidence"] = 0
+    if result["function_calls"]:
+        with stage("validate"):
+            calls, valid, repairs = validator_for(tools).repair_all(result["function_calls"])
+        result["function_calls"] = calls
+        result["schema_valid"] = valid
+        if repairs:
+            result["repairs"] = repairs
+    if "early_exit" not in result and not overran and decode_tokens >= max_tokens:
+        # Decoding hit the cap: a runaway or looping generation. Keep its calls
+        # only if they came out valid; otherwise make sure the router hands off.
+        result["budget_exhausted"] = max_tokens
+        if not result.get("schema_valid"):
+            result["function_calls"] = []
+            result["confidence"] = 0
+    if selected is not tools:
+        result["selected_tools"] = [t["name"] for t in selected]
+    if not overran:
+        latency_estimators["local"].observe(result["total_time_ms"])
+    return result
 
 
-def generate_cloud(messages, tools):
-    """Run function calling via Gemini Cloud API."""
-    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+_cloud_client = None
+_cloud_client_lock = threading.Lock()
+_gemini_tools_cache = LRUCache(maxsize=32)
 
-    gemini_tools = [
+
+def get_cloud_client():
+    """Return the long-lived Gemini client so its HTTP connection pool is reused across calls."""
+    global _cloud_client
+    with _cloud_client_lock:
+        if _cloud_client is None:
+            genai, _ = _genai_lib()
+            _cloud_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+        return _cloud_client
+
+
+def set_cloud_client(client):
+    """Swap the Gemini client, e.g. for one pointed at a local stub server; None resets it."""
+    global _cloud_client
+    with _cloud_client_lock:
+        _cloud_client = client
+
+
+def _build_gemini_tools(tools):
+    _, types = _genai_lib()
+    return [
         types.Tool(function_declarations=[
             types.FunctionDeclaration(
                 name=t["name"],
@@ -58,7 +1318,7 @@ def generate_cloud(messages, tools):
                     type="OBJECT",
                     properties={
                         k: types.Schema(type=v["type"].upper(), description=v.get("description", ""))
-                        for k, v in t["parameters"]["properties"].items()
+                        for k, v in t["parameters"].get("properties", {}).items()
                     },
                     required=t["parameters"].get("required", []),
                 ),
@@ -67,48 +1327,950 @@ def generate_cloud(messages, tools):
         ])
     ]
 
-    contents = [m["content"] for m in messages if m["role"] == "user"]
 
+def gemini_tools_for(tools):
+    """Converted Gemini tool declarations for a tool list, cached by tool_set_key."""
+    key = tool_set_key(tools)
+    gemini_tools = _gemini_tools_cache.get(key)
+    if gemini_tools is None:
+        gemini_tools = _build_gemini_tools(tools)
+        _gemini_tools_cache.put(key, gemini_tools)
+    return gemini_tools
+
+
+_engine_loop = None
+_engine_lock = threading.Lock()
+
+
+def _engine():
+    """The background event loop that runs every hybrid pipeline, started on first use.
+
+    Sync and async entry points alike hand their coroutine to this one loop, so
+    the cloud dispatcher and the SDK's async client live on a single loop no
+    matter how many threads or caller loops are involved.
+    """
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            import asyncio
+            _engine_loop = asyncio.new_event_loop()
+            threading.Thread(target=_engine_loop.run_forever, name="hybrid-engine", daemon=True).start()
+        return _engine_loop
+
+
+def _run_sync(coro):
+    """Run a pipeline coroutine on the engine loop and block until it finishes."""
+    import asyncio
+    loop = _engine()
+    if threading.current_thread().name == "hybrid-engine":
+        coro.close()
+        raise RuntimeError("blocking hybrid call made from the engine loop; await the *_async variant instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def _on_engine(coro):
+    """Await a pipeline coroutine from any event loop; cancelling the caller cancels it on the engine."""
+    import asyncio
+    loop = _engine()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+async def _in_thread(pool_name, max_workers, fn, *args):
+    """Run blocking fn on a named executor from the engine loop, inside the caller's trace."""
+    import asyncio
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor(pool_name, max_workers), lambda: context.run(fn, *args))
+
+
+async def _local(messages, tools):
+    """generate_cactus on the local executor (one thread per pooled handle), stopping the model if cancelled."""
+    import asyncio
+    run = LocalRun()
+    try:
+        return await _in_thread("local", get_model_pool().size, generate_cactus, messages, tools, run)
+    except asyncio.CancelledError:
+        run.cancel()
+        raise
+
+
+class CloudRejected(TimeoutError):
+    """The cloud dispatcher turned a call away: its queue was full, or no slot freed up in time."""
+
+
+class CloudDispatcher:
+    """Single entry point for cloud calls, so concurrent fallbacks share work and respect limits.
+
+    Identical requests (same messages and tool set) that are in flight, or that
+    finished less than CONFIG["cloud_coalesce_window_ms"] ago, share one backend
+    call. At most max_concurrency calls run at once; up to
+    CONFIG["cloud_max_pending"] callers queue behind them, and beyond that new
+    callers are rejected immediately (CloudRejected) rather than piling onto
+    the quota. Lives on the engine loop, so it needs no locks.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._slots = None
+        self._inflight = {}
+        self._recent = {}
+        self._waiting = 0
+        self.stats = {"calls": 0, "coalesced": 0, "rejected": 0}
+
+    @staticmethod
+    def _key(messages, tools):
+        return json.dumps(messages, sort_keys=True, default=str) + tool_set_key(tools)
+
+    async def call(self, messages, tools):
+        """Cloud call; each caller gets its own copy of the result, timed from its arrival.
+
+        The caller that started the request is never reported faster than the
+        backend measured itself, so replayed (unslept) responses keep their
+        recorded latency. A shared request is only cancelled once every caller
+        waiting on it has been.
+        """
+        import asyncio
+        start_time = time.time()
+        key = self._key(messages, tools)
+        now = time.time()
+        self._recent = {k: v for k, v in self._recent.items() if v[0] > now}
+
+        entry = self._inflight.get(key)
+        owner = False
+        if entry is not None:
+            self.stats["coalesced"] += 1
+        elif key in self._recent:
+            self.stats["coalesced"] += 1
+            entry = [self._recent[key][1], 0]
+        else:
+            task = asyncio.ensure_future(self._run(messages, tools))
+            entry = self._inflight[key] = [task, 0]
+            owner = True
+            task.add_done_callback(lambda t: self._finish(key, t))
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            with stage("cloud", coalesced=entry[1] > 1 or task.done()):
+                result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+        result = copy.deepcopy(result)
+        wall_ms = (time.time() - start_time) * 1000
+        result["total_time_ms"] = max(wall_ms, result["total_time_ms"]) if owner else wall_ms
+        return result
+
+    def clear_recent(self):
+        """Forget finished results kept for coalescing, so separate runs don't share them."""
+        self._recent = {}
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._recent[key] = (time.time() + CONFIG["cloud_coalesce_window_ms"] / 1000, task)
+
+    async def _run(self, messages, tools):
+        import asyncio
+        start_time = time.time()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        if self._slots.locked():
+            if self._waiting >= CONFIG["cloud_max_pending"]:
+                self.stats["rejected"] += 1
+                raise CloudRejected("cloud dispatcher queue is full")
+            self._waiting += 1
+            try:
+                with stage("cloud_queue"):
+                    await asyncio.wait_for(self._slots.acquire(), CONFIG["cloud_queue_timeout_s"])
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                raise CloudRejected(f"no cloud slot free after {CONFIG['cloud_queue_timeout_s']}s") from None
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+        try:
+            self.stats["calls"] += 1
+            backend = get_cloud_backend()
+            if hasattr(backend, "generate_async"):
+                result = await backend.generate_async(messages, tools)
+            else:
+                result = await _in_thread("cloud", CONFIG["cloud_workers"], backend.generate, messages, tools)
+        finally:
+            self._slots.release()
+        latency_estimators["cloud"].observe(max((time.time() - start_time) * 1000, result["total_time_ms"]))
+        return result
+
+
+_cloud_dispatcher = None
+
+
+def get_cloud_dispatcher():
+    """The process-wide CloudDispatcher, sized by CONFIG["cloud_max_concurrency"] on first use."""
+    global _cloud_dispatcher
+    with _cloud_client_lock:
+        if _cloud_dispatcher is None:
+            _cloud_dispatcher = CloudDispatcher(CONFIG["cloud_max_concurrency"])
+        return _cloud_dispatcher
+
+
+def generate_cloud(messages, tools):
+    """Run function calling via Gemini Cloud API."""
+    return _run_sync(_cloud(messages, tools))
+
+
+async def generate_cloud_async(messages, tools):
+    """Async generate_cloud; runs on the SDK's asyncio client and can be cancelled."""
+    return await _on_engine(_cloud(messages, tools))
+
+
+async def _cloud(messages, tools):
+    with tracing("generate_cloud") as trace:
+        result = await get_cloud_dispatcher().call(messages, tools)
+    if trace is not None:
+        result["stages"] = trace.stages()
+    return result
+
+
+async def generate_cactus_async(messages, tools):
+    """Async generate_cactus on the executor bound to the model pool; cancelling stops generation."""
+    return await _on_engine(_in_session(_session.get(), _local(messages, tools)))
+
+
+async def _in_session(session, coro):
+    """Await coro on the engine loop as part of the caller's conversation."""
+    token = _session.set(session)
+    try:
+        return await coro
+    finally:
+        _session.reset(token)
+
+
+_INTENT_SEPARATOR = re.compile(r",\s*(?:and\s+|then\s+)?|;\s*|\s+(?:and then|and|then|also)\s+", re.IGNORECASE)
+# Words that open a new request. A clause starting with anything else is
+# glued back onto the previous one ("saying hello and goodbye").
+_INTENT_STARTERS = {
+    "add", "ask", "book", "call", "cancel", "check", "create", "email", "find", "get", "how", "how's",
+    "look", "message", "navigate", "open", "order", "pause", "play", "remind", "schedule", "search",
+    "send", "set", "show", "start", "stop", "tell", "text", "turn", "wake", "what", "what's", "when",
+    "where", "will",
+}
+_PRONOUN = re.compile(r"\b(him|her|them)\b", re.IGNORECASE)
+# A capitalized word in a slot that names a person ("text Tom", "message to Tom",
+# "look up Tom"), as opposed to a place ("the weather in London").
+_NAME_SLOT = re.compile(r"(?i:\b(?:text|call|message|email|ask|tell|find|contact|meet|invite|with|send|"
+                        r"(?:look|search)\s+(?:up|for)|(?:message|send|write|email|reply|talk|speak|hi|hello)\s+to)\s+)"
+                        r"([A-Z][a-z]+)\b")
+_SAYING = re.compile(r"\b(?:saying|that says|says)\b", re.IGNORECASE)
+# Inside a quoted message, "call me later" is the message talking, not a new request.
+_TO_SENDER = re.compile(r"^(?:call|text|message|email|ring|ping|meet|ask|send)\s+(?:me|us)\b", re.IGNORECASE)
+
+
+def decompose_query(text):
+    """Split a compound request into single-intent sub-queries.
+
+    "Find Tom in my contacts and send him a message" becomes
+    ["Find Tom in my contacts", "send Tom a message"]: pronouns in later
+    clauses are resolved to the most recent person named before them, and
+    left alone when there is none. A message being dictated ("saying see you
+    tonight and call me later") stays in one piece. Pieces glued back together
+    keep the separator the user typed between them, so apart from resolved
+    pronouns every sub-query is a substring of the request.
+    """
+    body = text.strip().rstrip(".!?")
+    spans, start = [], 0
+    for end, next_start in [(m.start(), m.end()) for m in _INTENT_SEPARATOR.finditer(body)] + [(len(body), None)]:
+        piece = body[start:end]
+        lo = start + len(piece) - len(piece.lstrip())
+        hi = start + len(piece.rstrip())
+        start = next_start
+        if lo >= hi:
+            continue
+        piece = body[lo:hi]
+        first = piece.split()[0].lower()
+        if spans and (first not in _INTENT_STARTERS or (_SAYING.search(body[spans[-1][0]:spans[-1][1]])
+                                                         and _TO_SENDER.match(piece))):
+            spans[-1][1] = hi
+        else:
+            spans.append([lo, hi])
+    parts = [body[lo:hi] for lo, hi in spans]
+
+    resolved, last_name = [], None
+    for part in parts:
+        if last_name:
+            part = _PRONOUN.sub(last_name, part)
+        names = _NAME_SLOT.findall(_SAYING.split(part)[0])
+        if names:
+            last_name = names[-1]
+        resolved.append(part)
+    return resolved or [text]
+
+
+def _count_intents(text):
+    """Rough count of the separate requests packed into one user message."""
+    return len(decompose_query(text))
+
+
+def _last_user_text(messages):
+    for m in reversed(messages):
+        if m["role"] == "user":
+            return m["content"]
+    return ""
+
+
+def fallback_prior(messages, tools):
+    """Cheap pre-score in [0, 1]: how likely local generation is to end in a cloud fallback.
+
+    Uses only the request itself (intent count, tool count, message length), so it
+    can be computed before any model runs.
+    """
+    text = _last_user_text(messages)
+    z = -1.5 + 2.5 * (_count_intents(text) - 1) + 0.3 * (len(tools) - 1) + 0.02 * len(text.split())
+    return 1 / (1 + math.exp(-z))
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(name, max_workers):
+    """Named, process-wide thread pool, created on first use and replaced by a larger one if asked."""
+    with _executors_lock:
+        pool = _executors.get(name)
+        if pool is None or pool._max_workers < max_workers:
+            from concurrent.futures import ThreadPoolExecutor
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = _executors[name] = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        return pool
+
+
+_speculating = 0
+
+
+def _speculate_cloud(messages, tools):
+    """Start a cloud call as a task on the engine loop; returns it, or None if all slots are busy."""
+    import asyncio
+    global _speculating
+    if _speculating >= CONFIG["speculate_max_inflight"]:
+        return None
+    _speculating += 1
+    task = asyncio.ensure_future(get_cloud_dispatcher().call(messages, tools))
+
+    def done(_):
+        global _speculating
+        _speculating -= 1
+
+    task.add_done_callback(done)
+    return task
+
+
+_FAST_STOPWORDS = {"a", "an", "and", "by", "for", "from", "given", "in", "of", "on", "or", "the", "to", "with"}
+_CLOCK = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m\.?\b|\b(\d{1,2}):(\d{2})\b", re.IGNORECASE)
+_CLOCK_TEXT = re.compile(r"\b\d{1,2}(?::\d{2})?\s*[AaPp]\.?[Mm]\.?")
+_PLACE = re.compile(r"\bin ((?:[A-Z][\w'-]*)(?: [A-Z][\w'-]*)*)")
+_PLACE_CONTINUES = re.compile(r"\.\s*[\w]|,\s*[A-Z]")
+_QUOTED = re.compile(r"\b(?:saying|that says|says)\s+(.+)$", re.IGNORECASE)
+_PERSON = re.compile(r"(?<=\s)([A-Z][a-z]+)\b")
+# Request words that stand for a tool name's leading verb ("what's the weather" asks get_weather).
+_FAST_VERBS = {
+    "get": {"get", "what", "how", "check", "show", "tell"},
+    "set": {"set", "wake"},
+    "send": {"send", "text", "message"},
+    "search": {"search", "find", "look"},
+    "create": {"create", "add", "make", "remind"},
+    "play": {"play", "put"},
+}
+# Words that undo, negate or shift a request; the schemas can't say which, so the model decides.
+_FAST_DECLINE = {
+    "cancel", "delete", "remove", "clear", "stop", "undo", "not", "don", "dont", "never", "no", "later",
+    "earlier", "before", "after", "instead", "change", "move", "snooze", "reschedule", "unless", "except",
+}
+
+
+def _param_kind(name, spec, siblings):
+    """Classify a parameter by name, type and description into an extractor kind, or None."""
+    name, words = name.lower(), f"{name} {spec.get('description', '')}".lower()
+    if spec.get("type") == "integer":
+        if "hour" in name:
+            return "hour"
+        if "minute" in name and any("hour" in s.lower() for s in siblings):
+            return "minute"
+        return "count"
+    if spec.get("type") != "string":
+        return None
+    if "time" in name:
+        return "clock"
+    if any(w in words for w in ("location", "city")):
+        return "place"
+    if any(w in name for w in ("message", "text", "content", "body")):
+        return "quoted"
+    # Only the parameter name: "Song or playlist name" describes a title, not a person.
+    if any(w in name for w in ("recipient", "contact", "person", "name")):
+        return "person"
+    return None
+
+
+class FastPathMatcher:
+    """Resolves trivial single-call requests from patterns compiled out of the tool schemas.
+
+    A tool is chosen only if its name shares a word with the request, the
+    request uses the tool's verb (see _FAST_VERBS) and it outscores every
+    other tool; each required argument, and each optional one the request
+    mentions, must be extracted by an unambiguous pattern for its parameter
+    type. Requests that cancel, negate or shift
+    something ("later", "before") and anything less certain return None so
+    the request goes to the model.
+    """
+
+    def __init__(self, tools):
+        self.tools = tools
+        self.specs = []
+        for t in tools:
+            properties = t["parameters"].get("properties", {})
+            kinds = {k: _param_kind(k, v, list(properties)) for k, v in properties.items()}
+            name_stems = _stems(t["name"]) - _FAST_STOPWORDS
+            desc_stems = _stems(t["description"]) - _FAST_STOPWORDS - {"set", "get"}
+            self.specs.append((t, kinds, name_stems, name_stems | desc_stems))
+
+    def match(self, text):
+        if not self.specs:
+            return None
+        words = set(re.findall(r"[a-z]+", _QUOTED.sub("", text).lower()))
+        if words & _FAST_DECLINE:
+            return None
+        stems = _stems(text)
+        scored = sorted(((len(all_stems & stems), len(name_stems & stems), i)
+                         for i, (_, _, name_stems, all_stems) in enumerate(self.specs)), reverse=True)
+        best, name_hits, index = scored[0]
+        if not name_hits or (len(scored) > 1 and scored[1][0] >= best):
+            return None
+        tool, kinds, _, _ = self.specs[index]
+        verb = tool["name"].lower().split("_")[0]
+        if not words & _FAST_VERBS.get(verb, {verb}):
+            return None
+        args = {}
+        required = tool["parameters"].get("required", [])
+        for key in tool["parameters"].get("properties", {}):
+            value = self._extract(kinds.get(key), key, text)
+            if value is not None:
+                args[key] = value
+            elif key in required or _stems(key.replace("_", " ")) & stems:
+                return None  # missing, or said but not extractable ("labeled pasta")
+        if not args and tool["parameters"].get("properties"):
+            return None
+        call = {"name": tool["name"], "arguments": args}
+        return call if validate_call(call, self.tools) else None
+
+    @staticmethod
+    def _extract(kind, key, text):
+        if kind in ("hour", "minute"):
+            clocks = _CLOCK.findall(text)
+            if len(clocks) != 1:
+                return None
+            hour, minute, meridiem, hour24, minute24 = clocks[0]
+            if meridiem.lower() == "p" or (meridiem and int(hour) == 12):
+                return None  # 12h vs 24h encoding (and midnight) is a guess; leave it to the model
+            hour, minute = int(hour or hour24), int(minute or minute24 or 0)
+            if not (0 <= hour <= 23 and 0 <= minute <= 59):
+                return None
+            return hour if kind == "hour" else minute
+        if kind == "count":
+            unit = key.lower().rstrip("s")
+            counts = re.findall(rf"\b(\d+)\s*-?\s*{re.escape(unit)}s?\b", text, re.IGNORECASE)
+            return int(counts[0]) if len(counts) == 1 else None
+        if kind == "clock":
+            times = _CLOCK_TEXT.findall(text)
+            return times[0].strip() if len(times) == 1 else None
+        if kind == "place":
+            places = list(_PLACE.finditer(text))
+            if len(places) != 1:
+                return None
+            # "St. Louis", "Washington D.C.", "Paris, Texas": the name goes on past what was captured.
+            if _PLACE_CONTINUES.match(text, places[0].end()):
+                return None
+            return places[0].group(1)
+        if kind == "quoted":
+            quoted = _QUOTED.findall(text)
+            return quoted[0].strip().rstrip(".!?") if len(quoted) == 1 else None
+        if kind == "person":
+            names = _PERSON.findall(_QUOTED.sub("", text))
+            return names[0] if len(names) == 1 else None
+        return None
+
+
+_fast_paths = LRUCache(maxsize=16)
+
+
+def fast_path(messages, tools):
+    """Resolve a single-turn, single-intent request without any model; returns a result or None."""
+    if len(messages) != 1 or messages[0]["role"] != "user":
+        return None
+    text = messages[0]["content"]
+    if _count_intents(text) != 1:
+        return None
     start_time = time.time()
+    key = tool_set_key(tools)
+    matcher = _fast_paths.get(key)
+    if matcher is None:
+        matcher = FastPathMatcher(tools)
+        _fast_paths.put(key, matcher)
+    call = matcher.match(text)
+    if call is None:
+        return None
+    return {
+        "function_calls": [call],
+        "total_time_ms": (time.time() - start_time) * 1000,
+        "confidence": 1.0,
+        "fast_path": True,
+    }
 
-    gemini_response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=contents,
-        config=types.GenerateContentConfig(tools=gemini_tools),
-    )
-
-    total_time_ms = (time.time() - start_time) * 1000
-
-    function_calls = []
-    for candidate in gemini_response.candidates:
-        for part in candidate.content.parts:
-            if part.function_call:
-                function_calls.append({
-                    "name": part.function_call.name,
-                    "arguments": dict(part.function_call.args),
-                })
 
+ROUTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router.json")
+
+
+def router_features(messages, tools, local):
+    """Signals the router scores a local result on; all are cheap to compute after generation."""
+    text = _last_user_text(messages)
+    intents = _count_intents(text)
+    calls = local["function_calls"]
     return {
-        "function_calls": function_calls,
-        "total_time_ms": total_time_ms,
+        "bias": 1.0,
+        "confidence": float(local["confidence"]),
+        "schema_valid": float(bool(calls) and local.get("schema_valid", True) and all(validate_call(c, tools) for c in calls)),
+        "calls_match_intents": float(len(calls) == intents),
+        "extra_intents": float(intents - 1),
+        "tools": float(len(tools)),
+        "words": float(len(text.split())),
+        "early_exit": float(local.get("early_exit") == "complete"),
     }
 
 
+class RoutingModel:
+    """Logistic regression over router_features estimating P(local result is correct)."""
+
+    def __init__(self, weights, threshold):
+        self.weights = weights
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path=ROUTER_PATH):
+        """Trained parameters from path, or None if nothing has been trained yet."""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            params = json.load(f)
+        return cls(params["weights"], params["threshold"])
+
+    def score(self, features):
+        z = sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+        return 1 / (1 + math.exp(-max(-60.0, min(60.0, z))))
+
+    def accept(self, features):
+        return self.score(features) >= self.threshold
+
+
+_router = None
+_router_loaded = False
+
+
+def get_router():
+    """The process-wide RoutingModel, loaded on first use; None until router.json exists."""
+    global _router, _router_loaded
+    if not _router_loaded:
+        _router = RoutingModel.load()
+        _router_loaded = True
+    return _router
+
+
+def accept_local(messages, tools, local, confidence_threshold):
+    """Decide whether a local result is good enough to return without the cloud."""
+    if local.get("fast_path"):
+        return True
+    if not local["function_calls"] or not local.get("schema_valid", True):
+        return False  # nothing usable, or calls the validator could not repair
+    router = get_router() if CONFIG["router"] == "learned" else None
+    if router is not None:
+        return router.accept(router_features(messages, tools, local))
+    return local["confidence"] >= confidence_threshold
+
+
+def normalize_query(text):
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return " ".join(text.lower().split()).rstrip(".!?")
+
+
+def _arguments_grounded(calls, text):
+    """True if every argument value in calls literally appears in text.
+
+    A reworded query can embed close to a cached one while asking about a
+    different city or time, so semantic hits are only reused when the cached
+    arguments are still present in the new message.
+    """
+    text = normalize_query(text)
+    for call in calls:
+        for value in call.get("arguments", {}).values():
+            if str(value).lower().rstrip(".!?") not in text:
+                return False
+    return True
+
+
+class ResponseCache:
+    """Cache of generate_hybrid results keyed on the normalized conversation and tool set.
+
+    Lookups try an exact match first, then (if a similarity threshold is given)
+    the nearest cached query under the same tool set by embedding cosine.
+    Entries expire after ttl_s seconds and the least recently used are evicted
+    past maxsize.
+    """
+
+    def __init__(self, maxsize=1024, ttl_s=600.0):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    @staticmethod
+    def _key(messages, tools):
+        turns = tuple((m["role"], normalize_query(str(m.get("content", ""))),
+                       json.dumps(m.get("function_calls"), sort_keys=True, default=str)) for m in messages)
+        return turns, tool_set_key(tools)
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires"] < now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def lookup(self, messages, tools, semantic_threshold=None):
+        """Return (cached result, tier) or (None, None)."""
+        key = self._key(messages, tools)
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits["exact"] += 1
+                return copy.deepcopy(entry["result"]), "exact"
+
+        if semantic_threshold is not None and len(messages) == 1:
+            text = messages[0]["content"]
+            vector = embed_text(text)
+            best, best_score = None, semantic_threshold
+            with self._lock:
+                for other_key in list(self._entries):
+                    entry = self._live(other_key, now)
+                    if entry is None or other_key[1] != key[1] or entry["vector"] is None:
+                        continue
+                    score = sum(a * b for a, b in zip(vector, entry["vector"]))
+                    if score >= best_score and _arguments_grounded(entry["result"]["function_calls"], text):
+                        best, best_score = other_key, score
+                if best is not None:
+                    self._entries.move_to_end(best)
+                    self.hits["semantic"] += 1
+                    return copy.deepcopy(self._entries[best]["result"]), "semantic"
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def store(self, messages, tools, result, semantic=False):
+        """Cache a result that produced calls; embeds the query too when semantic lookups are on."""
+        if not result.get("function_calls"):
+            return
+        vector = embed_text(messages[0]["content"]) if semantic and len(messages) == 1 else None
+        key = self._key(messages, tools)
+        with self._lock:
+            self._entries[key] = {"result": copy.deepcopy(result), "vector": vector, "expires": time.time() + self.ttl_s}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {"hits": dict(self.hits), "misses": self.misses, "size": len(self._entries),
+                    "hit_rate": sum(self.hits.values()) / lookups if lookups else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = {"exact": 0, "semantic": 0}
+            self.misses = 0
+
+
+response_cache = ResponseCache()
+
+
 def generate_hybrid(messages, tools, confidence_threshold=0.99):
-    """Baseline hybrid inference strategy; fall back to cloud if Cactus Confidence is below threshold."""
-    local = generate_cactus(messages, tools)
+    """Baseline hybrid inference strategy; fall back to cloud if Cactus Confidence is below threshold.
+
+    confidence_threshold applies when CONFIG["router"] is "threshold"; the
+    default "learned" router uses the threshold tuned into router.json.
+    Inside `with latency_budget(ms):` the call also aims to answer within ms.
+    """
+    return _run_sync(_hybrid(messages, tools, confidence_threshold, _latency_budget.get(), _session.get()))
+
+
+async def generate_hybrid_async(messages, tools, confidence_threshold=0.99):
+    """Async generate_hybrid. Cancelling it cancels in-flight cloud requests and stops local generation."""
+    return await _on_engine(_hybrid(messages, tools, confidence_threshold, _latency_budget.get(), _session.get()))
+
 
-    if local["confidence"] >= confidence_threshold:
+async def _hybrid(messages, tools, confidence_threshold, budget_ms=None, session=None):
+    """The hybrid pipeline, traced; result["stages"] holds milliseconds per stage.
+
+    budget_ms and session carry the caller's latency_budget and conversation
+    over to the engine loop.
+    """
+    token = _deadline.set(None if budget_ms is None else time.time() + budget_ms / 1000)
+    session_token = _session.set(session)
+    try:
+        with tracing("generate_hybrid") as trace:
+            result = await _cached_route(messages, tools, confidence_threshold)
+    finally:
+        _session.reset(session_token)
+        _deadline.reset(token)
+    if trace is not None:
+        result["stages"] = trace.stages()
+    return result
+
+
+async def _cached_route(messages, tools, confidence_threshold):
+    """Repeated requests are answered from response_cache and count as on-device."""
+    if not CONFIG["cache"]:
+        return await _route(messages, tools, confidence_threshold)
+
+    start_time = time.time()
+    semantic_threshold = CONFIG["cache_semantic_threshold"]
+    with stage("cache_lookup"):
+        if semantic_threshold is None:
+            cached, tier = response_cache.lookup(messages, tools)
+        else:  # embedding the query runs the model, so keep it off the loop
+            cached, tier = await _in_thread("local", get_model_pool().size, response_cache.lookup,
+                                            messages, tools, semantic_threshold)
+    if cached is not None:
+        for stale in ("local_confidence", "speculative"):
+            cached.pop(stale, None)
+        cached["total_time_ms"] = (time.time() - start_time) * 1000
+        cached["source"] = "on-device"
+        cached["cache"] = tier
+        return cached
+
+    result = await _route(messages, tools, confidence_threshold)
+    if result.get("deadline_exceeded") or result.get("cloud_rejected"):
+        # Cut short by this caller's budget or a backed-up cloud; a later caller may get the full answer.
+        return result
+    with stage("cache_store"):
+        if semantic_threshold is None:
+            response_cache.store(messages, tools, result)
+        else:
+            await _in_thread("local", get_model_pool().size, response_cache.store, messages, tools, result, True)
+    return result
+
+
+async def _route(messages, tools, confidence_threshold):
+    """Run FunctionGemma and fall back to Gemini when accept_local rejects its result.
+
+    Trivial requests are answered by the rule-based fast path without a model.
+    Multi-intent messages are decomposed and routed per sub-query. Otherwise,
+    when the pre-score predicts a likely fallback, the cloud request is started
+    speculatively while the local model runs and cancelled if local wins.
+
+    Under a latency budget, a request goes straight to cloud if only cloud is
+    expected to finish in time, speculates if a sequential fallback would not
+    fit, and otherwise stops local generation early enough to leave room for one.
+    If the cloud dispatcher rejects the fallback, the local answer is returned
+    flagged cloud_rejected.
+    """
+    if CONFIG["fast_path"]:
+        with stage("fast_path"):
+            fast = fast_path(messages, tools)
+        if fast is not None:
+            fast["source"] = "on-device"
+            return fast
+
+    if CONFIG["decompose"]:
+        with stage("decompose"):
+            subqueries = decompose_query(_last_user_text(messages))
+        if len(subqueries) > 1:
+            return await _route_decomposed(messages, tools, subqueries, confidence_threshold)
+
+    speculative = None
+    if CONFIG["speculate"] and fallback_prior(messages, tools) >= CONFIG["speculate_min_prior"]:
+        speculative = _speculate_cloud(messages, tools)
+
+    deadline = local_deadline = _deadline.get()
+    if deadline is not None:
+        with stage("deadline_plan"):
+            left = remaining_ms()
+            local_ms, cloud_ms = latency_estimators["local"].estimate(), latency_estimators["cloud"].estimate()
+            cloud_only = cloud_ms <= left < local_ms
+            if not cloud_only and cloud_ms <= left:
+                if speculative is None and CONFIG["speculate"] and local_ms + cloud_ms > left:
+                    speculative = _speculate_cloud(messages, tools)
+                if speculative is None:
+                    local_deadline = deadline - cloud_ms / 1000
+        if cloud_only:
+            start_time = time.time()
+            try:
+                cloud = await _by_deadline(speculative or get_cloud_dispatcher().call(messages, tools))
+                flag = "deadline_exceeded"
+            except CloudRejected:
+                cloud, flag = None, "cloud_rejected"
+            if cloud is None:
+                cloud = {"function_calls": [], "total_time_ms": (time.time() - start_time) * 1000,
+                         "confidence": 0, flag: True}
+            cloud["source"] = "cloud (deadline)"
+            return cloud
+
+    token = _deadline.set(local_deadline)
+    try:
+        local = await _local(messages, tools)
+    except BaseException:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    finally:
+        _deadline.reset(token)
+
+    with stage("route"):
+        accepted = accept_local(messages, tools, local, confidence_threshold)
+    if accepted:
+        if speculative is not None:
+            speculative.cancel()
         local["source"] = "on-device"
         return local
 
-    cloud = generate_cloud(messages, tools)
+    start_time = time.time()
+    flag = "deadline_exceeded"
+    try:
+        if speculative is not None:
+            # The cloud call has been running since before local generation, so
+            # only the time spent waiting on it now adds to the request latency.
+            cloud = await _by_deadline(speculative)
+            if cloud is not None:
+                wait_ms = (time.time() - start_time) * 1000
+                cloud["total_time_ms"] = max(wait_ms, cloud["total_time_ms"] - local["total_time_ms"])
+                cloud["speculative"] = True
+        elif deadline is not None and local["function_calls"] and latency_estimators["cloud"].estimate() > remaining_ms():
+            cloud = None  # not expected back in time; don't start it
+        else:
+            cloud = await _by_deadline(get_cloud_dispatcher().call(messages, tools))
+    except CloudRejected:
+        cloud, flag = None, "cloud_rejected"
+    if cloud is None:
+        # Out of time, or the cloud is backed up: the unconfident local answer beats none at all.
+        local["source"] = "on-device"
+        local[flag] = True
+        local["total_time_ms"] += (time.time() - start_time) * 1000
+        return local
     cloud["source"] = "cloud (fallback)"
     cloud["local_confidence"] = local["confidence"]
     cloud["total_time_ms"] += local["total_time_ms"]
     return cloud
 
 
+async def _by_deadline(awaitable):
+    """Await a cloud call until the request's deadline, cancelling it there; None if time ran out."""
+    import asyncio
+    left = remaining_ms()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(0.0, left) / 1000)
+    except asyncio.TimeoutError:
+        if remaining_ms() > 0:
+            raise  # the dispatcher's own rejection, not the deadline
+        return None
+
+
+async def _generate_local(messages, tools):
+    """Fast path if it is certain, FunctionGemma otherwise."""
+    return (CONFIG["fast_path"] and fast_path(messages, tools)) or await _local(messages, tools)
+
+
+async def _route_decomposed(messages, tools, subqueries, confidence_threshold):
+    """Run each sub-query on its own pooled handle, then send only the unconfident ones to cloud.
+
+    Calls are merged in sub-query order. The result is on-device only if every
+    sub-query stayed local. Sub-queries overlap, so each stage costs its
+    wall-clock time, or its slowest sub-query's reported time if that is longer.
+    """
+    import asyncio
+    history = messages[:-1]
+    sub_messages = [history + [{"role": "user", "content": q}] for q in subqueries]
+
+    deadline = _deadline.get()
+    local_deadline = deadline
+    if deadline is not None and latency_estimators["cloud"].estimate() <= remaining_ms():
+        # Sub-queries never speculate, so leave time for their cloud fallbacks.
+        local_deadline = deadline - latency_estimators["cloud"].estimate() / 1000
+
+    start_time = time.time()
+    token = _deadline.set(local_deadline)
+    try:
+        locals_ = await asyncio.gather(*(_generate_local(m, tools) for m in sub_messages))
+    finally:
+        _deadline.reset(token)
+    local_ms = max([(time.time() - start_time) * 1000] + [r["total_time_ms"] for r in locals_])
+
+    with stage("route"):
+        failed = [i for i, r in enumerate(locals_) if not accept_local(sub_messages[i], tools, r, confidence_threshold)]
+    sent = failed
+    if deadline is not None and latency_estimators["cloud"].estimate() > remaining_ms():
+        # Not expected back in time: only sub-queries with no local answer at all are worth trying.
+        sent = [i for i in failed if not locals_[i]["function_calls"]]
+    start_time = time.time()
+    dispatcher = get_cloud_dispatcher()
+    rejected = []
+
+    async def fallback(i):
+        try:
+            return await _by_deadline(dispatcher.call(sub_messages[i], tools))
+        except CloudRejected:
+            rejected.append(i)
+            return None
+
+    answers = await asyncio.gather(*(fallback(i) for i in sent))
+    clouds = {i: r for i, r in zip(sent, answers) if r is not None}
+    cloud_ms = max([(time.time() - start_time) * 1000] + [r["total_time_ms"] for r in clouds.values()]) if failed else 0
+
+    function_calls, parts = [], []
+    for i, query in enumerate(subqueries):
+        source = "cloud" if i in clouds else "on-device"
+        function_calls.extend((clouds[i] if i in clouds else locals_[i])["function_calls"])
+        parts.append({"query": query, "source": source, "confidence": locals_[i]["confidence"]})
+
+    result = {
+        "function_calls": function_calls,
+        "total_time_ms": local_ms + cloud_ms,
+        "confidence": min(r["confidence"] for r in locals_),
+        "subqueries": parts,
+    }
+    if rejected:
+        result["cloud_rejected"] = True
+    if len(clouds) + len(rejected) < len(failed):
+        result["deadline_exceeded"] = True
+    if not clouds:
+        result["source"] = "on-device"
+    elif len(clouds) == len(subqueries):
+        result["source"] = "cloud (fallback)"
+    else:
+        result["source"] = "hybrid (partial fallback)"
+    return result
+
+
 def print_result(label, result):
     """Pretty-print a generation result."""
     print(f"\n=== {label} ===\n")
@@ -0,0 +1,195 @@
+"""
+Record real local/cloud responses once, then replay them offline through
+generate_hybrid's routing logic.
+
+Usage:
+    python benchmark.py --record runs/cactus.jsonl.gz        # real Cactus + Gemini, captured
+    python benchmark.py --replay runs/cactus.jsonl.gz        # same cases, no models, no sleeping
+
+Recording wraps the installed backends and stores every raw cactus_complete
+response (with the token stream it produced) and every Gemini result, keyed by
+the exact request: prompt messages, tools and generation options. Replay hands
+the store to stub_backend's stubs, which stream the recorded tokens back and
+report the recorded timings, so routing variants can be scored in seconds.
+Requests that were never recorded fall back to the stubs' synthetic answers
+and are counted in RecordingStore.stats["misses"].
+"""
+
+import copy, hashlib, json, os, threading, time
+
+from stub_backend import query_key
+
+
+def request_key(kind, messages, tools, options=None):
+    """Stable key for one backend request; the streaming callback counts only as on/off."""
+    options = dict(options or {})
+    options["stream"] = options.pop("callback", None) is not None
+    blob = json.dumps([kind, messages, tools, options], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class RecordingStore:
+    """Recorded responses, saved as gzipped JSONL (one {"kind", "key", "query", ...} per line).
+
+    lookup() falls back from the exact request to the latest response recorded
+    for the same kind and query, so a sweep over generation options still finds
+    an answer when only one configuration was recorded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._by_query = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "approximate": 0, "misses": 0}
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def _open(self, path, mode):
+        if path.endswith(".gz"):
+            import gzip
+            return gzip.open(path, mode + "t")
+        return open(path, mode)
+
+    def load(self, path):
+        with self._open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            entries = list(self._entries.values())
+        with self._open(path, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _index(self, entry):
+        self._entries[entry["key"]] = entry
+        self._by_query[(entry["kind"], entry["query"])] = entry
+
+    def add(self, kind, messages, tools, options, response, tokens=None, elapsed_ms=None):
+        entry = {"kind": kind, "key": request_key(kind, messages, tools, options),
+                 "query": query_key(messages), "response": response}
+        if tokens is not None:
+            entry["tokens"] = tokens
+        if elapsed_ms is not None:
+            entry["elapsed_ms"] = elapsed_ms
+        with self._lock:
+            self._index(entry)
+
+    def lookup(self, kind, messages, tools, options=None, exact=False):
+        with self._lock:
+            entry = self._entries.get(request_key(kind, messages, tools, options))
+            if entry is not None:
+                self.stats["hits"] += 1
+                return entry
+            entry = None if exact else self._by_query.get((kind, query_key(messages)))
+            self.stats["approximate" if entry is not None else "misses"] += 1
+            return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RecordingLocalBackend:
+    """Wraps a local backend and records each complete() call into a RecordingStore."""
+
+    def __init__(self, inner, store):
+        self.inner = inner
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def complete(self, model, messages, **options):
+        request_options = {k: v for k, v in options.items() if k != "tools"}
+        tokens = None
+        callback = options.get("callback")
+        if callback is not None:
+            tokens = []
+
+            def record_token(token, token_id, user_data):
+                tokens.append(token)
+                callback(token, token_id, user_data)
+
+            options = dict(options, callback=record_token)
+        start_time = time.time()
+        raw_str = self.inner.complete(model, messages, **options)
+        elapsed_ms = (time.time() - start_time) * 1000
+        try:
+            response = json.loads(raw_str)
+        except json.JSONDecodeError:
+            return raw_str
+        self.store.add("local", messages, options.get("tools"), request_options, response, tokens, elapsed_ms)
+        return raw_str
+
+
+class RecordingCloudBackend:
+    """Wraps a cloud backend and records each generate() result into a RecordingStore."""
+
+    def __init__(self, inner, store):
+        self.inner = inner
+        self.store = store
+
+    def generate(self, messages, tools):
+        result = self.inner.generate(messages, tools)
+        self.store.add("cloud", messages, tools, None, result)
+        return result
+
+    async def generate_async(self, messages, tools):
+        if not hasattr(self.inner, "generate_async"):
+            import asyncio
+            return await asyncio.get_running_loop().run_in_executor(None, self.generate, messages, tools)
+        result = await self.inner.generate_async(messages, tools)
+        self.store.add("cloud", messages, tools, None, result)
+        return result
+
+
+class CachingLocalBackend(RecordingLocalBackend):
+    """Answers exact repeats of a recorded request from the store without running the model.
+
+    Everything else runs on the wrapped backend and is recorded, so a sweep over
+    routing-only settings generates each distinct request once.
+    """
+
+    def __init__(self, inner, store):
+        super().__init__(inner, store)
+        self._replaying = {}  # id(handle) -> stopped
+
+    def stop(self, model):
+        if id(model) in self._replaying:
+            self._replaying[id(model)] = True
+        else:
+            self.inner.stop(model)
+
+    def complete(self, model, messages, **options):
+        request_options = {k: v for k, v in options.items() if k != "tools"}
+        entry = self.store.lookup("local", messages, options.get("tools"), request_options, exact=True)
+        if entry is None:
+            return super().complete(model, messages, **options)
+        callback = options.get("callback")
+        self._replaying[id(model)] = False
+        try:
+            for i, token in enumerate(entry.get("tokens") or () if callback is not None else ()):
+                if self._replaying[id(model)]:
+                    break
+                callback(token, i, None)
+        finally:
+            del self._replaying[id(model)]
+        return json.dumps(entry["response"])
+
+
+class CachingCloudBackend(RecordingCloudBackend):
+    """Cloud counterpart of CachingLocalBackend."""
+
+    def generate(self, messages, tools):
+        entry = self.store.lookup("cloud", messages, tools, exact=True)
+        return copy.deepcopy(entry["response"]) if entry is not None else super().generate(messages, tools)
+
+    async def generate_async(self, messages, tools):
+        entry = self.store.lookup("cloud", messages, tools, exact=True)
+        if entry is not None:
+            return copy.deepcopy(entry["response"])
+        return await super().generate_async(messages, tools)
@@ -0,0 +1,360 @@
+"""
+Long-running daemon that owns the model pool and caches and serves generate_hybrid
+to other processes.
+
+Usage:
+    python serve.py                                   # Unix socket at $HYBRID_SOCKET (/tmp/cactus-hybrid.sock)
+    python serve.py --http 8765 --pool-size 4 --backend stub
+
+    from serve import generate_hybrid                 # drop-in client shim
+    result = generate_hybrid(messages, tools)
+
+The socket speaks JSON lines: one request object per line, answered by one
+response line with the same "id". Requests are {"op": "generate", "messages",
+"tools", "confidence_threshold", "deadline_ms"}, {"op": "stats"} or {"op": "ping"};
+responses are {"id", "ok": true, "result"} or {"id", "ok": false, "error",
+"status"}. With --http, POST /generate and GET /stats take and return the same
+objects on localhost, with status 429 when the queue is full and 504 past a
+deadline.
+
+At most --pool-size requests run at once, one per warm FunctionGemma handle;
+up to --max-queue more wait for a slot and the rest are turned away. A
+request's deadline covers its time in the queue and in the pipeline: what
+is left of it once a handle is free becomes the pipeline's latency_budget,
+and the request is cancelled outright shortly after it passes.
+"""
+
+import json, os, signal, socket, stat, threading, time
+
+import main
+
+SOCKET_PATH = os.environ.get("HYBRID_SOCKET", "/tmp/cactus-hybrid.sock")
+# Seconds past a request's deadline before it is cancelled outright.
+DEADLINE_GRACE_S = 0.1
+
+
+class ServerError(RuntimeError):
+    """A request the daemon refused or failed; status is the HTTP-style code it answered with."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def _check_generate(request):
+    """Raise a 400 ServerError unless request has the shape generate_hybrid expects."""
+    messages, tools = request.get("messages"), request.get("tools")
+    if not isinstance(messages, list) or not messages:
+        raise ServerError("messages must be a non-empty list", 400)
+    for m in messages:
+        if not isinstance(m, dict) or not isinstance(m.get("role"), str):
+            raise ServerError("each message must be an object with a string role", 400)
+        if m.get("content") is not None and not isinstance(m["content"], str):
+            raise ServerError("message content must be a string", 400)
+    if not any(m["role"] == "user" for m in messages):
+        raise ServerError("messages need a user turn", 400)
+    if not isinstance(tools, list):
+        raise ServerError("tools must be a list", 400)
+    for t in tools:
+        if (not isinstance(t, dict) or not isinstance(t.get("name"), str) or not isinstance(t.get("description"), str)
+                or not isinstance(t.get("parameters"), dict)):
+            raise ServerError("each tool must be an object with a string name, a string description "
+                              "and a parameters object", 400)
+        properties = t["parameters"].get("properties", {})
+        if not isinstance(properties, dict) or not all(
+                isinstance(p, dict) and isinstance(p.get("type"), str) for p in properties.values()):
+            raise ServerError(f"tool {t['name']!r}: parameters.properties must map names to objects with a string type", 400)
+        required = t["parameters"].get("required", [])
+        if not isinstance(required, list) or not all(isinstance(r, str) for r in required):
+            raise ServerError(f"tool {t['name']!r}: parameters.required must be a list of names", 400)
+    for key in ("confidence_threshold", "deadline_ms"):
+        value = request.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ServerError(f"{key} must be a non-negative number", 400)
+
+
+class HybridServer:
+    """Admission control and dispatch for daemon requests, on the daemon's event loop."""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._slots = None
+        self._queued = 0
+        self._running = 0
+        self.stats = {"served": 0, "rejected": 0, "expired": 0, "failed": 0}
+
+    async def handle(self, request):
+        """Response object for one request object."""
+        op = request.get("op", "generate")
+        try:
+            if op == "ping":
+                return {"ok": True}
+            if op == "stats":
+                return {"ok": True, "stats": self.snapshot()}
+            if op != "generate":
+                raise ServerError(f"unknown op {op!r}", 400)
+            return {"ok": True, "result": await self._generate(request)}
+        except ServerError as e:
+            return {"ok": False, "error": str(e), "status": e.status}
+        except Exception as e:
+            self.stats["failed"] += 1
+            return {"ok": False, "error": f"{type(e).__name__}: {e}", "status": 500}
+
+    async def _generate(self, request):
+        import asyncio
+        _check_generate(request)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        start_time = time.time()
+        deadline_ms = request.get("deadline_ms")
+        deadline = None if deadline_ms is None else start_time + deadline_ms / 1000
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.time())
+
+        if self._slots.locked():
+            if self._queued >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise ServerError("server busy: queue is full", 429)
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), remaining())
+            except asyncio.TimeoutError:
+                self.stats["expired"] += 1
+                raise ServerError("deadline exceeded while queued", 504) from None
+            finally:
+                self._queued -= 1
+        else:
+            await self._slots.acquire()
+        queue_ms = (time.time() - start_time) * 1000
+
+        self._running += 1
+        budget_ms = None if deadline is None else remaining() * 1000
+        try:
+            # The pipeline plans for the budget and answers by the deadline on
+            # its own; the timeout only catches one that still overruns it.
+            with main.latency_budget(budget_ms):
+                result = await asyncio.wait_for(
+                    main.generate_hybrid_async(request["messages"], request["tools"],
+                                               request.get("confidence_threshold", 0.99)),
+                    None if deadline is None else remaining() + DEADLINE_GRACE_S)
+        except asyncio.TimeoutError:
+            self.stats["expired"] += 1
+            raise ServerError("deadline exceeded", 504) from None
+        finally:
+            self._running -= 1
+            self._slots.release()
+        self.stats["served"] += 1
+        result["queue_ms"] = queue_ms
+        return result
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "running": self._running,
+            "queued": self._queued,
+            "pool": main.get_model_pool().stats,
+            "cache": main.response_cache.stats(),
+            "cloud": main.get_cloud_dispatcher().stats,
+            "latency": {name: e.stats() for name, e in main.latency_estimators.items()},
+        }
+
+    async def serve_lines(self, reader, writer):
+        """One JSON-lines connection; requests on it run concurrently and answer as they finish."""
+        import asyncio
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(request):
+            response = await self.handle(request)
+            response["id"] = request.get("id")
+            async with write_lock:
+                writer.write(json.dumps(response, default=str).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    request = None
+                if not isinstance(request, dict):
+                    request = {"op": "invalid"}
+                task = asyncio.ensure_future(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve_http(self, reader, writer):
+        """Minimal HTTP/1.1 on localhost: POST /generate, GET /stats, GET /ping; one request per connection."""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                response = {"ok": False, "error": "bad request", "status": 400}
+            elif request_line[0] == "POST" and request_line[1] == "/generate":
+                try:
+                    request = json.loads(body or b"{}")
+                except json.JSONDecodeError:
+                    request = None
+                if not isinstance(request, dict):
+                    request = {"op": "invalid"}
+                response = await self.handle(dict(request, op="generate") if "op" not in request else request)
+            elif request_line[0] == "GET" and request_line[1] in ("/stats", "/ping"):
+                response = await self.handle({"op": request_line[1][1:]})
+            else:
+                response = {"ok": False, "error": "not found", "status": 404}
+            status = response.get("status", 200)
+            payload = json.dumps(response, default=str).encode()
+            writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except (ConnectionError, EOFError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(socket_path=SOCKET_PATH, http_port=None, pool_size=None, max_queue=64):
+    """Run the daemon until cancelled; the model pool is loaded up front."""
+    import asyncio
+    if os.path.exists(socket_path):
+        # A leftover socket from a daemon that died is safe to replace; a live one is not.
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            raise RuntimeError(f"{socket_path} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socket_path)
+        else:
+            raise RuntimeError(f"another daemon is already serving on {socket_path}")
+        finally:
+            probe.close()
+    pool_size = pool_size or os.cpu_count() or 1
+    pool = main.get_model_pool(pool_size)
+    await asyncio.get_running_loop().run_in_executor(None, pool.warmup)
+    server = HybridServer(pool_size, max_queue)
+
+    servers = [await asyncio.start_unix_server(server.serve_lines, path=socket_path)]
+    print(f"Serving generate_hybrid on {socket_path} ({pool_size} handles, queue {max_queue})", flush=True)
+    if http_port is not None:
+        servers.append(await asyncio.start_server(server.serve_http, host="127.0.0.1", port=http_port))
+        print(f"HTTP on http://127.0.0.1:{http_port}/generate", flush=True)
+    serving = asyncio.gather(*(s.serve_forever() for s in servers))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for s in servers:
+            s.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+class HybridClient:
+    """Blocking client for the daemon's socket; one connection per thread, reused across calls."""
+
+    def __init__(self, socket_path=SOCKET_PATH, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            conn = self._local.conn = (sock, sock.makefile("rb"), [0])
+        return conn
+
+    def request(self, request):
+        sock, reader, counter = self._connection()
+        counter[0] += 1
+        request = dict(request, id=counter[0])
+        try:
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            line = reader.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError("daemon closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            if response.get("status") == 504:
+                raise TimeoutError(response["error"])
+            raise ServerError(response["error"], response.get("status", 500))
+        return response
+
+    def generate_hybrid(self, messages, tools, confidence_threshold=0.99, deadline_ms=None):
+        request = {"op": "generate", "messages": messages, "tools": tools,
+                   "confidence_threshold": confidence_threshold}
+        if deadline_ms is not None:
+            request["deadline_ms"] = deadline_ms
+        return self.request(request)["result"]
+
+    def stats(self):
+        return self.request({"op": "stats"})["stats"]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn[0].close()
+            self._local.conn = None
+
+
+_client = None
+
+
+def generate_hybrid(messages, tools, confidence_threshold=0.99, deadline_ms=None):
+    """main.generate_hybrid, answered by the daemon at $HYBRID_SOCKET.
+
+    Raises TimeoutError past deadline_ms and ServerError when the daemon is busy or fails.
+    """
+    global _client
+    if _client is None:
+        _client = HybridClient()
+    return _client.generate_hybrid(messages, tools, confidence_threshold, deadline_ms)
+
+
+if __name__ == "__main__":
+    import argparse, asyncio
+    parser = argparse.ArgumentParser(description="Serve generate_hybrid from one warm process")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path (default: $HYBRID_SOCKET)")
+    parser.add_argument("--http", type=int, metavar="PORT", help="Also serve HTTP on 127.0.0.1:PORT")
+    parser.add_argument("--pool-size", type=int, help="Warm FunctionGemma handles = concurrent requests (default: CPU count)")
+    parser.add_argument("--max-queue", type=int, default=64, help="Requests allowed to wait for a handle")
+    parser.add_argument("--backend", choices=["cactus", "stub"], default="cactus")
+    args = parser.parse_args()
+
+    if args.backend == "stub":
+        from benchmark import use_backend
+        use_backend("stub")
+    try:
+        asyncio.run(serve(args.socket, args.http, args.pool_size, args.max_queue))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        parser.exit(1, f"serve.py: {e}\n")
@@ -0,0 +1,375 @@
+"""
+Deterministic offline backends for main.py, so routing, caching and benchmark
+code can run on any machine without the cactus build or a Gemini key.
+
+Usage:
+    import main
+    from stub_backend import StubLocalBackend, StubCloudBackend
+    main.set_backends(local=StubLocalBackend(answers), cloud=StubCloudBackend(answers))
+
+Both stubs replay recorded outputs when they have one for a query (a
+{query_key: record} dict from load_recordings, or a recordings.RecordingStore),
+and otherwise synthesize a response whose latency and confidence are drawn from configurable
+distributions. Draws are seeded per query, so the same inputs always give the
+same outputs.
+"""
+
+import copy, hashlib, json, math, random, re, time
+
+
+def query_key(messages):
+    """Normalized text of the last user turn; recordings and answers are keyed by it."""
+    if isinstance(messages, str):
+        text = messages
+    else:
+        text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    return " ".join(text.lower().split())
+
+
+def load_recordings(path):
+    """Load a JSONL file of {"query", "local", "cloud"} records into {query_key: record}."""
+    recordings = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[query_key(record["query"])] = record
+    return recordings
+
+
+def answers_from_cases(cases):
+    """Map each benchmark case's query to its expected calls, for use as stub ground truth.
+
+    Cases that list sub_queries (see synth.py) also map each sub-query to its own call.
+    """
+    answers = {}
+    for case in cases:
+        answers[query_key(case["messages"])] = case["expected_calls"]
+        for text, call in zip(case.get("sub_queries", ()), case["expected_calls"]):
+            answers.setdefault(query_key(text), [call])
+    return answers
+
+
+def _grounded(call, key):
+    """True if every argument value of call shows up in the normalized query text."""
+    for value in call["arguments"].values():
+        if value != 0 and str(value).lower() not in key:
+            return False
+    return True
+
+
+def lookup_answer(answers, key):
+    """Expected calls for a query: an exact entry, or else (for sub-queries of a
+    recorded compound request) every known call whose arguments all appear in it."""
+    if key in answers:
+        return answers[key]
+    found, seen = [], set()
+    for calls in answers.values():
+        for call in calls:
+            ident = json.dumps(call, sort_keys=True)
+            if ident not in seen and _grounded(call, key):
+                seen.add(ident)
+                found.append(call)
+    return found or None
+
+
+def _draw(rng, spec, lo=0.0, hi=math.inf):
+    """Sample from a (mean, stddev) spec, clamped to [lo, hi]."""
+    mean, std = spec
+    return min(hi, max(lo, rng.gauss(mean, std)))
+
+
+# Voice fixtures for the stub "Whisper": each character is an 80 ms sine whose
+# pitch codes it, so any prefix of the audio decodes to a prefix of the text.
+TONE_RATE = 16000
+TONE_SAMPLES = TONE_RATE * 80 // 1000
+
+
+def encode_tones(text, trailing_silence_ms=600):
+    """16-bit mono PCM samples (array "h") speaking text in tone code, followed by silence."""
+    from array import array
+    samples = array("h")
+    for char in text:
+        code = ord(char) if 32 <= ord(char) < 127 else ord("?")
+        freq = 200 + 20 * (code - 32)
+        samples.extend(int(8000 * math.sin(2 * math.pi * freq * i / TONE_RATE + math.pi / 4))
+                       for i in range(TONE_SAMPLES))
+    samples.extend([0] * (TONE_RATE * trailing_silence_ms // 1000))
+    return samples
+
+
+def decode_tones(samples):
+    """Text coded in samples by encode_tones; trailing partial characters and silence are dropped."""
+    chars = []
+    for start in range(0, len(samples) - TONE_SAMPLES + 1, TONE_SAMPLES):
+        segment = samples[start:start + TONE_SAMPLES]
+        if max(segment) == 0 and min(segment) == 0:
+            continue
+        crossings = sum((a < 0) != (b < 0) for a, b in zip(segment, segment[1:]))
+        freq = crossings * TONE_RATE / (2 * TONE_SAMPLES)
+        chars.append(chr(32 + max(0, min(94, round((freq - 200) / 20)))))
+    return "".join(chars)
+
+
+def _format_calls(calls):
+    """Render calls in FunctionGemma's raw output format, as streamed token by token."""
+    out = []
+    for call in calls:
+        args = ",".join(f"{k}:<escape>{v}<escape>" for k, v in call["arguments"].items())
+        out.append(f"<start_function_call>call:{call['name']}{{{args}}}<end_function_call>")
+    return "".join(out)
+
+
+class _StubModel:
+    def __init__(self, model_path, index):
+        self.model_path = model_path
+        self.index = index
+        self.stopped = False
+        self.kv_prefix = None
+        self.kv_turns = []
+
+
+class StubLocalBackend:
+    """Stands in for the cactus bindings.
+
+    answers maps query_key -> expected calls; with probability `accuracy` the stub
+    returns them with a confidence drawn from `confidence_hit`, otherwise no calls
+    with a confidence drawn from `confidence_miss`. Latencies are drawn from
+    `latency_ms` and slept for real unless sleep=False. A miss that is not handed
+    off runs away with probability `runaway`: it opens a call and never closes
+    it, decoding to max_tokens at `decode_ms_per_token`. Like cactus, a handle
+    that is not reset between calls skips prefill of the system prompt and tool
+    block when the next prompt starts with the same ones, and of the earlier
+    turns of a conversation it already holds.
+    """
+
+    def __init__(self, answers=None, recordings=None, accuracy=0.7, latency_ms=(120.0, 40.0),
+                 confidence_hit=(0.95, 0.04), confidence_miss=(0.6, 0.2), runaway=0.3,
+                 decode_ms_per_token=4.0, init_ms=0.0, transcripts=None, transcribe_ms=(40.0, 25.0),
+                 seed=0, sleep=True):
+        self.answers = answers or {}
+        self.recordings = recordings if recordings is not None else {}
+        self.accuracy = accuracy
+        self.latency_ms = latency_ms
+        self.confidence_hit = confidence_hit
+        self.confidence_miss = confidence_miss
+        self.runaway = runaway
+        self.decode_ms_per_token = decode_ms_per_token
+        self.init_ms = init_ms
+        self.transcripts = transcripts or {}
+        self.transcribe_ms = transcribe_ms
+        self.seed = seed
+        self.sleep = sleep
+        self.inits = 0
+
+    def _rng(self, key):
+        return random.Random(f"{self.seed}:local:{key}")
+
+    def _wait(self, ms):
+        if self.sleep and ms > 0:
+            time.sleep(ms / 1000)
+
+    def init(self, model_path):
+        self.inits += 1
+        self._wait(self.init_ms)
+        return _StubModel(model_path, self.inits)
+
+    def reset(self, model):
+        model.kv_prefix = None
+        model.kv_turns = []
+
+    def stop(self, model):
+        model.stopped = True
+
+    def destroy(self, model):
+        pass
+
+    def _recorded(self, messages, tools, options):
+        if hasattr(self.recordings, "lookup"):
+            return self.recordings.lookup("local", messages, tools, options)
+        record = self.recordings.get(query_key(messages))
+        return {"response": record["local"]} if record is not None and "local" in record else None
+
+    def _replay(self, model, entry, callback):
+        """Play a recorded response back, re-streaming its tokens so early exit behaves as it did live."""
+        response = dict(entry["response"])
+        tokens = entry.get("tokens")
+        if callback is None or not tokens:
+            self._wait(response.get("total_time_ms", 0))
+            return json.dumps(response)
+        ttft_ms = response.get("time_to_first_token_ms", 0)
+        step_ms = (response.get("total_time_ms", 0) - ttft_ms) / len(tokens)
+        self._wait(ttft_ms)
+        for i, token in enumerate(tokens):
+            if model.stopped:
+                break
+            self._wait(step_ms)
+            callback(token, i, None)
+        return json.dumps(response)
+
+    def complete(self, model, messages, tools=None, callback=None, max_tokens=256, **options):
+        model.stopped = False
+        key = query_key(messages)
+        entry = self._recorded(messages, tools, dict(options, callback=callback, max_tokens=max_tokens))
+        if entry is not None:
+            return self._replay(model, entry, callback)
+
+        rng = self._rng(key)
+        tool_names = {t["function"]["name"] for t in tools or []}
+        expected = lookup_answer(self.answers, key)
+        if expected is not None and rng.random() < self.accuracy:
+            calls = [c for c in expected if c["name"] in tool_names]
+            confidence = _draw(rng, self.confidence_hit, 0.0, 1.0)
+        else:
+            calls = []
+            confidence = _draw(rng, self.confidence_miss, 0.0, 1.0)
+
+        text = _format_calls(calls)
+        decode_tokens = max(1, len(text) // 4)
+        total_ms = _draw(rng, self.latency_ms, 1.0)
+        ttft_ms = total_ms * 0.3
+        if decode_tokens > max_tokens:
+            # Cut off at max_tokens: decoding takes that much less time.
+            total_ms = ttft_ms + (total_ms - ttft_ms) * max_tokens / decode_tokens
+            calls, text, decode_tokens = [], text[:max_tokens * 4], max_tokens
+        if not calls and tools and rng.random() < self.runaway:
+            tool = tools[0]["function"]
+            param = next(iter(tool["parameters"].get("properties", {})), "value")
+            text = f"<start_function_call>call:{tool['name']}{{{param}:<escape>" + "and " * max_tokens
+            text = text[:max_tokens * 4]
+            decode_tokens = max_tokens
+            total_ms = ttft_ms + decode_tokens * self.decode_ms_per_token
+        system = [m for m in messages if m["role"] == "system"]
+        turns = [(m["role"], str(m.get("content") or "")) for m in messages if m["role"] != "system"]
+        prefix = json.dumps([system, tools], sort_keys=True)
+        prefix_tokens = sum(len(json.dumps(t)) // 4 for t in tools or []) + sum(len(m["content"]) // 4 for m in system)
+        history_tokens = sum(len(content) // 4 for _, content in turns[:-1])
+        prefill_tokens = prefix_tokens + history_tokens + len(key) // 4
+        # The drawn latency is for a single-turn prompt; earlier turns cost prefill in proportion.
+        extra_ms = ttft_ms * history_tokens / max(1, prefill_tokens - history_tokens)
+        ttft_ms += extra_ms
+        total_ms += extra_ms
+        if model.kv_prefix == prefix:
+            # Reused: the system prompt and tool block, plus the turns the KV cache already holds.
+            # Models cactus keeping the longest common prefix of cache and prompt and dropping
+            # the rest (the last request's own turn and output); assumed, not measured on device.
+            held = 0
+            while held < min(len(model.kv_turns), len(turns) - 1) and model.kv_turns[held] == turns[held]:
+                held += 1
+            reused = prefix_tokens + sum(len(content) // 4 for _, content in turns[:held])
+            saved_ms = ttft_ms * reused / max(1, prefill_tokens)
+            ttft_ms -= saved_ms
+            total_ms -= saved_ms
+            prefill_tokens -= reused
+        model.kv_prefix = prefix
+        # Below cactus's confidence_threshold it hands off right after prefill.
+        handoff = confidence < options.get("confidence_threshold", 0.7)
+        if handoff:
+            calls, text, decode_tokens, total_ms = [], "", 0, ttft_ms
+
+        if callback is not None:
+            self._wait(ttft_ms)
+            step_ms = (total_ms - ttft_ms) / max(1, decode_tokens)
+            emitted = 0
+            for i in range(0, len(text), 4):
+                if model.stopped:
+                    break
+                self._wait(step_ms)
+                callback(text[i:i + 4], i // 4, None)
+                emitted += 1
+            if model.stopped:
+                total_ms = ttft_ms + step_ms * emitted
+                decode_tokens = emitted
+                calls = []
+            else:
+                self._wait(total_ms - ttft_ms - step_ms * emitted)
+        else:
+            self._wait(total_ms)
+        # The cache now holds this prompt followed by what was generated.
+        model.kv_turns = turns + [("assistant", text)]
+
+        return json.dumps({
+            "success": not handoff,
+            "error": None,
+            "cloud_handoff": handoff,
+            "response": text,
+            "function_calls": calls,
+            "confidence": confidence,
+            "time_to_first_token_ms": ttft_ms,
+            "total_time_ms": total_ms,
+            "prefill_tokens": prefill_tokens,
+            "decode_tokens": decode_tokens,
+        })
+
+    def embed(self, model, text, normalize=False):
+        """Hashed bag-of-words vector; similar wording gives similar vectors."""
+        vec = [0.0] * 256
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            vec[int(hashlib.md5(word.encode()).hexdigest(), 16) % 256] += 1.0
+        if normalize:
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            vec = [v / norm for v in vec]
+        return vec
+
+    def transcribe(self, model, audio_path, prompt=""):
+        """Text from `transcripts` by path, else decoded from a tone-coded WAV; takes
+        transcribe_ms = (fixed ms, ms per second of audio)."""
+        import wave
+        from array import array
+        with wave.open(audio_path, "rb") as f:
+            samples = array("h", f.readframes(f.getnframes()))
+            audio_s = f.getnframes() / f.getframerate()
+        text = self.transcripts.get(audio_path)
+        if text is None:
+            text = decode_tones(samples)
+        total_ms = self.transcribe_ms[0] + self.transcribe_ms[1] * audio_s
+        self._wait(total_ms)
+        return json.dumps({"success": True, "response": text, "total_time_ms": total_ms})
+
+
+class StubCloudBackend:
+    """Stands in for Gemini; same replay/answers/latency scheme as StubLocalBackend."""
+
+    def __init__(self, answers=None, recordings=None, accuracy=0.95, latency_ms=(600.0, 150.0),
+                 seed=0, sleep=True):
+        self.answers = answers or {}
+        self.recordings = recordings if recordings is not None else {}
+        self.accuracy = accuracy
+        self.latency_ms = latency_ms
+        self.seed = seed
+        self.sleep = sleep
+        self.calls = 0
+
+    def _recorded(self, messages, tools):
+        if hasattr(self.recordings, "lookup"):
+            entry = self.recordings.lookup("cloud", messages, tools)
+            return entry and entry["response"]
+        record = self.recordings.get(query_key(messages))
+        return record.get("cloud") if record is not None else None
+
+    def _respond(self, messages, tools):
+        self.calls += 1
+        key = query_key(messages)
+        recorded = self._recorded(messages, tools)
+        if recorded is not None:
+            result = copy.deepcopy(recorded)
+        else:
+            rng = random.Random(f"{self.seed}:cloud:{key}")
+            tool_names = {t["name"] for t in tools}
+            expected = lookup_answer(self.answers, key) or []
+            calls = [c for c in expected if c["name"] in tool_names] if rng.random() < self.accuracy else []
+            result = {"function_calls": calls, "total_time_ms": _draw(rng, self.latency_ms, 1.0)}
+        return result
+
+    def generate(self, messages, tools):
+        result = self._respond(messages, tools)
+        if self.sleep:
+            time.sleep(result["total_time_ms"] / 1000)
+        return result
+
+    async def generate_async(self, messages, tools):
+        import asyncio
+        result = self._respond(messages, tools)
+        if self.sleep:
+            await asyncio.sleep(result["total_time_ms"] / 1000)
+        return result
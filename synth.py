@@ -0,0 +1,417 @@
+"""
+Seeded synthetic benchmark cases generated from tool-schema templates, streamed
+through JSONL, plus a suite that measures how the pipeline scales with catalog size.
+
+Usage:
+    python synth.py generate cases.jsonl.gz --cases 5000 --seed 1 --mix easy=0.2,medium=0.3,hard=0.5
+    python synth.py generate big.jsonl --cases 2000 --catalog-size 250
+    python benchmark.py --backend stub --cases cases.jsonl.gz
+    python synth.py scale --backend stub --sizes 5,25,100,500 --cases 200 --out scale.json
+
+Every case has the same fields as benchmark.py's hand-written ones (name,
+difficulty, messages, tools, expected_calls). Multi-call cases also carry
+sub_queries: the clause each expected call was generated from, as
+main.decompose_query splits it. The stub backends use those as ground truth
+for decomposed requests.
+
+Easy cases are one call with only its tool available. Medium cases are one
+call among 2-5 tools. Hard cases are 2 to max_calls calls among 4-6 tools. With
+catalog_size, every case instead shares one fixed catalog of that many tools.
+The catalogs are nested: the size-50 catalog is the first 50 tools of the
+size-500 one. Past the 26 base tools, the catalog grows with per-profile
+variants ("send_message_work": "... on my work profile"), which differ from
+their base tool only by a word or two.
+
+A corpus file starts with a catalog line holding every tool schema once:
+{"type": "catalog", "version", "seed", "mix", "tools"}. It is followed by one
+{"type": "case", ...} line per case, naming its tools. load_cases() streams the
+cases back, sharing one schema dict per tool. A path ending in .gz is gzipped.
+"""
+
+import json, random
+
+CORPUS_VERSION = 1
+DEFAULT_MIX = {"easy": 0.2, "medium": 0.3, "hard": 0.5}
+
+CITIES = ["San Francisco", "London", "Paris", "Tokyo", "Berlin", "Seattle", "Chicago", "Miami", "Sydney",
+          "Toronto", "Madrid", "Rome", "Denver", "Austin", "Boston", "Dublin", "Oslo", "Lisbon", "Vienna", "Prague"]
+PEOPLE = ["Alice", "Bob", "Tom", "Sarah", "Jake", "Emma", "Lisa", "John", "Maria", "David", "Nina", "Omar",
+          "Priya", "Chen", "Lucas", "Zoe", "Ravi", "Grace", "Leo", "Hana"]
+PHRASES = ["good morning", "running late", "see you soon", "happy birthday", "on my way", "call me back",
+           "dinner is ready", "thanks for today", "let's meet", "good night", "lunch at noon", "miss you"]
+TASKS = ["call the dentist", "buy milk", "water the plants", "pay rent", "walk the dog", "stretch",
+         "take medicine", "pick up laundry", "book flights", "return library books"]
+SONGS = ["Bohemian Rhapsody", "jazz", "lofi beats", "Clair de Lune", "Yellow Submarine", "classical music",
+         "Hotel California", "summer hits", "Imagine", "workout mix"]
+PLACES = ["the airport", "the office", "Central Park", "the train station", "the gym", "downtown", "the museum",
+          "the mall", "the beach", "the library"]
+DISHES = ["pizza", "sushi", "pad thai", "a burrito", "ramen", "a salad", "dumplings", "tacos"]
+ROOMS = ["kitchen", "bedroom", "living room", "garage", "office", "hallway", "bathroom"]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+TOPICS = ["climate", "the election", "football", "space travel", "electric cars", "the stock market", "science"]
+APPS = ["Spotify", "Maps", "Calendar", "Slack", "Notes", "Photos", "Camera"]
+GROCERIES = ["eggs", "bread", "coffee", "apples", "rice", "butter", "yogurt", "bananas"]
+SYMBOLS = ["AAPL", "GOOG", "MSFT", "TSLA", "AMZN", "NVDA", "META"]
+LANGUAGES = ["Spanish", "French", "German", "Japanese", "Italian", "Korean"]
+CUISINES = ["Italian", "Thai", "Mexican", "Indian", "Japanese", "Greek"]
+ACTIVITIES = ["running", "cycling", "yoga", "rowing", "swimming", "strength"]
+# Profile labels for tool variants; 26 base tools x 19 labels puts the pool past 500.
+PROFILES = ["work", "personal", "family", "travel", "home", "school", "shared", "kids", "office", "guest",
+            "studio", "garden", "lab", "club", "team", "project", "cabin", "boat", "backup"]
+
+
+def _clock(rng):
+    """(hour, minute, spoken): an AM time on a quarter hour, e.g. (7, 30, "7:30 AM")."""
+    hour, minute = rng.randint(5, 11), rng.choice([0, 0, 15, 30, 45])
+    return hour, minute, f"{hour}:{minute:02d} AM" if minute else f"{hour} AM"
+
+
+def _afternoon(rng):
+    return f"{rng.randint(1, 9)}:{rng.choice(['00', '15', '30', '45'])} PM"
+
+
+# Argument values by kind, drawn from rng; the clause says them as they are.
+KINDS = {
+    "city": lambda rng: rng.choice(CITIES),
+    "person": lambda rng: rng.choice(PEOPLE),
+    "phrase": lambda rng: rng.choice(PHRASES),
+    "task": lambda rng: rng.choice(TASKS),
+    "song": lambda rng: rng.choice(SONGS),
+    "place": lambda rng: rng.choice(PLACES),
+    "dish": lambda rng: rng.choice(DISHES),
+    "room": lambda rng: rng.choice(ROOMS),
+    "day": lambda rng: rng.choice(DAYS),
+    "topic": lambda rng: rng.choice(TOPICS),
+    "app": lambda rng: rng.choice(APPS),
+    "grocery": lambda rng: rng.choice(GROCERIES),
+    "symbol": lambda rng: rng.choice(SYMBOLS),
+    "language": lambda rng: rng.choice(LANGUAGES),
+    "cuisine": lambda rng: rng.choice(CUISINES),
+    "activity": lambda rng: rng.choice(ACTIVITIES),
+    "time": _afternoon,
+    "minutes": lambda rng: rng.choice([1, 2, 5, 10, 15, 20, 25, 30, 45, 60]),
+    "degrees": lambda rng: rng.randint(62, 78),
+}
+
+# Base tools: name, description, {param: (type, description, kind)} and ways of
+# asking for a call. Every phrasing opens with one of main._INTENT_STARTERS, so
+# a compound request decomposes back into them. set_alarm's "clock" fills both
+# hour and minute from one spoken time.
+TEMPLATES = [
+    ("get_weather", "Get current weather for a location",
+     {"location": ("string", "City name", "city")},
+     ["What's the weather in {location}", "Check the weather in {location}", "How's the weather in {location}"]),
+    ("set_alarm", "Set an alarm for a given time",
+     {"hour": ("integer", "Hour to set the alarm for", "clock"), "minute": ("integer", "Minute to set the alarm for", "clock")},
+     ["Set an alarm for {clock}", "Wake me up at {clock}"]),
+    ("send_message", "Send a message to a contact",
+     {"recipient": ("string", "Name of the person to send the message to", "person"),
+      "message": ("string", "The message content to send", "phrase")},
+     ["Send a message to {recipient} saying {message}", "Text {recipient} saying {message}"]),
+    ("create_reminder", "Create a reminder with a title and time",
+     {"title": ("string", "Reminder title", "task"), "time": ("string", "Time for the reminder (e.g. 3:00 PM)", "time")},
+     ["Remind me to {title} at {time}"]),
+    ("search_contacts", "Search for a contact by name",
+     {"query": ("string", "Name to search for", "person")},
+     ["Find {query} in my contacts", "Look up {query} in my contacts", "Search for {query} in my contacts"]),
+    ("play_music", "Play a song or playlist",
+     {"song": ("string", "Song or playlist name", "song")},
+     ["Play {song}", "Play some {song}"]),
+    ("set_timer", "Set a countdown timer",
+     {"minutes": ("integer", "Number of minutes", "minutes")},
+     ["Set a timer for {minutes} minutes", "Start a {minutes} minute timer"]),
+    ("get_stock_price", "Get the latest price of a stock",
+     {"symbol": ("string", "Ticker symbol", "symbol")},
+     ["Get the stock price of {symbol}", "Check the price of {symbol} stock"]),
+    ("translate_text", "Translate a phrase into another language",
+     {"text": ("string", "Text to translate", "phrase"), "language": ("string", "Target language", "language")},
+     ["Tell me how to say {text} in {language}"]),
+    ("call_contact", "Start a phone call with a contact",
+     {"name": ("string", "Name of the person to call", "person")},
+     ["Call {name}", "Call {name} on the phone"]),
+    ("navigate_to", "Start turn-by-turn navigation to a destination",
+     {"destination": ("string", "Where to go", "place")},
+     ["Navigate to {destination}", "Show me directions to {destination}"]),
+    ("book_ride", "Book a ride to a destination",
+     {"destination": ("string", "Drop-off location", "place")},
+     ["Book a ride to {destination}", "Order a ride to {destination}"]),
+    ("order_food", "Order food for delivery",
+     {"item": ("string", "Dish to order", "dish")},
+     ["Order {item} for delivery", "Order some {item}"]),
+    ("turn_on_lights", "Turn on the lights in a room",
+     {"room": ("string", "Room name", "room")},
+     ["Turn on the lights in the {room}"]),
+    ("turn_off_lights", "Turn off the lights in a room",
+     {"room": ("string", "Room name", "room")},
+     ["Turn off the lights in the {room}"]),
+    ("set_thermostat", "Set the thermostat temperature",
+     {"temperature": ("integer", "Temperature in degrees Fahrenheit", "degrees")},
+     ["Set the thermostat to {temperature} degrees", "Set the heat to {temperature} degrees"]),
+    ("create_event", "Create a calendar event on a day",
+     {"title": ("string", "Event title", "task"), "day": ("string", "Day of the week", "day")},
+     ["Schedule time to {title} on {day}", "Create an event to {title} on {day}"]),
+    ("send_email", "Send an email to a contact about a subject",
+     {"recipient": ("string", "Name of the person to email", "person"), "subject": ("string", "Email subject", "topic")},
+     ["Email {recipient} about {subject}", "Send an email to {recipient} about {subject}"]),
+    ("search_web", "Search the web for a topic",
+     {"query": ("string", "Search terms", "topic")},
+     ["Search the web for {query}", "Look up {query} online"]),
+    ("open_app", "Open an app on the device",
+     {"app": ("string", "App name", "app")},
+     ["Open {app}", "Open the {app} app"]),
+    ("add_to_shopping_list", "Add an item to the shopping list",
+     {"item": ("string", "Item to add", "grocery")},
+     ["Add {item} to my shopping list", "Add {item} to the grocery list"]),
+    ("get_news", "Get the latest news headlines on a topic",
+     {"topic": ("string", "News topic", "topic")},
+     ["Show me the news about {topic}", "Get the latest news on {topic}"]),
+    ("check_calendar", "List the calendar events on a day",
+     {"day": ("string", "Day of the week", "day")},
+     ["Check my calendar for {day}", "What's on my calendar on {day}"]),
+    ("find_restaurant", "Find a restaurant by cuisine near a city",
+     {"cuisine": ("string", "Type of food", "cuisine"), "location": ("string", "City name", "city")},
+     ["Find a {cuisine} restaurant in {location}", "Search for {cuisine} food in {location}"]),
+    ("start_workout", "Start tracking a workout",
+     {"activity": ("string", "Workout type", "activity")},
+     ["Start a {activity} workout", "Start tracking a {activity} workout"]),
+    ("pause_music", "Pause whatever is playing", {}, ["Pause the music", "Pause playback"]),
+]
+_TEMPLATES = {name: (description, params, phrasings) for name, description, params, phrasings in TEMPLATES}
+
+
+def _schema(name, description, params):
+    return {
+        "name": name,
+        "description": description,
+        "parameters": {
+            "type": "object",
+            "properties": {p: {"type": kind, "description": desc} for p, (kind, desc, _) in params.items()},
+            "required": list(params),
+        },
+    }
+
+
+def tool_pool():
+    """Every tool the generator can use, as {name: (schema, base name, profile or None)}: the
+    base tools, then each profile's variants of them."""
+    pool = {}
+    for name, description, params, _ in TEMPLATES:
+        pool[name] = (_schema(name, description, params), name, None)
+    for profile in PROFILES:
+        for name, description, params, _ in TEMPLATES:
+            variant = f"{name}_{profile}"
+            pool[variant] = (_schema(variant, f"{description} (on the {profile} profile)", params), name, profile)
+    return pool
+
+
+def catalog(size, seed=0):
+    """A fixed catalog of `size` tools; smaller sizes are prefixes of larger ones for the same seed."""
+    pool = tool_pool()
+    if size > len(pool):
+        raise ValueError(f"catalog_size {size} exceeds the {len(pool)} tools the templates provide")
+    rng = random.Random(f"{seed}:catalog")
+    bases = [name for name, (_, _, profile) in pool.items() if profile is None]
+    variants = [name for name, (_, _, profile) in pool.items() if profile is not None]
+    rng.shuffle(bases)
+    rng.shuffle(variants)
+    return (bases + variants)[:size]
+
+
+def _call(rng, tool_name, pool):
+    """(expected call, clause asking for it) for one tool."""
+    _, base, profile = pool[tool_name]
+    _, params, phrasings = _TEMPLATES[base]
+    arguments, spoken = {}, {}
+    for param, (_, _, kind) in params.items():
+        if kind == "clock":
+            if "clock" not in spoken:
+                hour, minute, spoken["clock"] = _clock(rng)
+                arguments.update(hour=hour, minute=minute)
+            continue
+        arguments[param] = KINDS[kind](rng)
+        spoken[param] = arguments[param]
+    clause = rng.choice(phrasings).format(**spoken)
+    if profile is not None:
+        clause += f" on my {profile} profile"
+    return {"name": tool_name, "arguments": arguments}, clause
+
+
+def _join(clauses):
+    """One request from its clauses: "A", "A and b", or "A, b, and c"."""
+    clauses = [clauses[0]] + [c[0].lower() + c[1:] for c in clauses[1:]]
+    if len(clauses) == 1:
+        return clauses[0]
+    if len(clauses) == 2:
+        return f"{clauses[0]} and {clauses[1]}"
+    return ", ".join(clauses[:-1]) + f", and {clauses[-1]}"
+
+
+def parse_mix(text):
+    """"easy=0.2,medium=0.3,hard=0.5" -> normalized {difficulty: weight}."""
+    mix = {}
+    for part in text.split(","):
+        difficulty, _, weight = part.partition("=")
+        if difficulty.strip() not in DEFAULT_MIX:
+            raise ValueError(f"unknown difficulty {difficulty.strip()!r}; expected easy, medium or hard")
+        mix[difficulty.strip()] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("difficulty mix must have a positive weight")
+    return {d: w / total for d, w in mix.items()}
+
+
+def generate(n, seed=0, mix=None, catalog_size=None, max_calls=3):
+    """Yield n cases. Case i depends only on (seed, i), so any prefix of a larger run is the same."""
+    mix = mix or DEFAULT_MIX
+    if max_calls < 2 and mix.get("hard"):
+        raise ValueError("hard cases need max_calls >= 2")
+    pool = tool_pool()
+    shared = catalog(catalog_size, seed) if catalog_size else None
+    bases = [name for name, (_, _, profile) in pool.items() if profile is None]
+    difficulties, weights = zip(*mix.items())
+    for i in range(n):
+        rng = random.Random(f"{seed}:case:{i}")
+        difficulty = rng.choices(difficulties, weights)[0]
+        calls = 1 if difficulty != "hard" else rng.randint(2, max_calls)
+        if shared is not None:
+            names = shared
+            picked = rng.sample(shared, min(calls, len(shared)))
+        else:
+            size = {"easy": 1, "medium": rng.randint(2, 5), "hard": rng.randint(max(4, calls), max(6, calls))}[difficulty]
+            names = rng.sample(bases, size)
+            picked = names[:calls]
+            rng.shuffle(names)
+        generated = [_call(rng, name, pool) for name in picked]
+        case = {
+            "name": f"synth_{i:05d}_{difficulty}",
+            "difficulty": difficulty,
+            "messages": [{"role": "user", "content": _join([clause for _, clause in generated]) + rng.choice([".", "?", ""])}],
+            "tools": [pool[name][0] for name in names],
+            "expected_calls": [call for call, _ in generated],
+        }
+        if len(generated) > 1:
+            case["sub_queries"] = [clause for _, clause in generated]
+        yield case
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def write_cases(path, cases, seed=None, mix=None):
+    """Stream cases to a corpus file; returns how many were written.
+
+    Tool schemas go into the catalog line once, so cases must only use tools
+    from tool_pool().
+    """
+    pool = tool_pool()
+    count = 0
+    with _open(path, "w") as f:
+        header = {"type": "catalog", "version": CORPUS_VERSION, "seed": seed, "mix": mix,
+                  "tools": [schema for schema, _, _ in pool.values()]}
+        f.write(json.dumps(header, separators=(",", ":")) + "\n")
+        for case in cases:
+            line = dict(case, type="case", tools=[t["name"] for t in case["tools"]])
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+def load_cases(path):
+    """Yield the cases in a corpus file one at a time, with tool names resolved to shared schemas."""
+    tools = None
+    with _open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.pop("type", "case")
+            if kind == "catalog":
+                if record.get("version", CORPUS_VERSION) > CORPUS_VERSION:
+                    raise ValueError(f"{path}: corpus version {record['version']} is newer than this reader")
+                tools = {t["name"]: t for t in record["tools"]}
+                continue
+            if tools is None:
+                raise ValueError(f"{path}: case before the catalog line")
+            record["tools"] = [tools[name] for name in record["tools"]]
+            yield record
+
+
+def scaling_suite(sizes=(5, 10, 25, 50, 100, 250, 500), n=100, seed=0, mix=None, workers=1, backend=("stub",)):
+    """Run n generated cases against fixed catalogs of each size; returns one summary row per size.
+
+    Rows hold F1, reported latency (mean and p90), on-device ratio, total
+    score and mean tool_select time. The response cache and recent cloud
+    answers are cleared between sizes. Each size's tool index is built in its
+    first case.
+    """
+    import main
+    from benchmark import _percentile, _run_case, compute_total_score, use_backend
+
+    corpus = {size: list(generate(n, seed, mix, catalog_size=size)) for size in sizes}
+    use_backend(*backend, cases=[case for cases in corpus.values() for case in cases])
+    rows = []
+    for size in sizes:
+        main.response_cache.clear()
+        main.get_cloud_dispatcher().clear_recent()
+        cases = corpus[size]
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(_run_case, cases))
+        else:
+            results = [_run_case(case) for case in cases]
+        times = [r["total_time_ms"] for r in results]
+        row = {
+            "tools": size,
+            "cases": len(results),
+            "f1": sum(r["f1"] for r in results) / len(results),
+            "avg_ms": sum(times) / len(times),
+            "p90_ms": _percentile(times, 90),
+            "on_device": sum(r["source"] == "on-device" for r in results) / len(results),
+            "score": compute_total_score(results),
+            "tool_select_ms": sum(r["stages"].get("tool_select", 0.0) for r in results) / len(results),
+        }
+        rows.append(row)
+        print(f"  {row['tools']:>5} | {row['cases']:>5} | {row['f1']:>5.2f} | {row['avg_ms']:>8.1f} | {row['p90_ms']:>8.1f} | "
+              f"{100 * row['on_device']:>8.0f}% | {row['score']:>6.1f}% | {row['tool_select_ms']:>10.2f}", flush=True)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark cases and measure catalog-size scaling")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gen = sub.add_parser("generate", help="Write a seeded corpus to a JSONL file (.gz to compress)")
+    p_gen.add_argument("path")
+    p_gen.add_argument("--cases", type=int, default=1000)
+    p_gen.add_argument("--seed", type=int, default=0)
+    p_gen.add_argument("--mix", default="easy=0.2,medium=0.3,hard=0.5", help="Difficulty weights, e.g. easy=1,hard=1")
+    p_gen.add_argument("--catalog-size", type=int, help="Give every case the same catalog of this many tools")
+    p_gen.add_argument("--max-calls", type=int, default=3, help="Most calls in one hard case")
+    p_scale = sub.add_parser("scale", help="Report F1, latency and on-device ratio as the catalog grows")
+    p_scale.add_argument("--sizes", default="5,10,25,50,100,250,500")
+    p_scale.add_argument("--cases", type=int, default=100, help="Cases per catalog size")
+    p_scale.add_argument("--seed", type=int, default=0)
+    p_scale.add_argument("--mix", default="easy=0.2,medium=0.3,hard=0.5")
+    p_scale.add_argument("--workers", type=int, default=1)
+    p_scale.add_argument("--backend", choices=["cactus", "stub"], default="cactus")
+    p_scale.add_argument("--no-sleep", action="store_true", help="Score the stubs' reported latencies without sleeping them out")
+    p_scale.add_argument("--out", metavar="PATH", help="Also write the rows as JSON")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        mix = parse_mix(args.mix)
+        written = write_cases(args.path, generate(args.cases, args.seed, mix, args.catalog_size, args.max_calls),
+                              seed=args.seed, mix=mix)
+        print(f"{written} cases written to {args.path}")
+    else:
+        print(f"  {'tools':>5} | {'cases':>5} | {'F1':>5} | {'avg ms':>8} | {'p90 ms':>8} | {'on-device':>9} | {'score':>7} | {'select ms':>10}")
+        rows = scaling_suite([int(s) for s in args.sizes.split(",")], args.cases, args.seed, parse_mix(args.mix),
+                             args.workers, (args.backend, None, args.seed, False if args.no_sleep else None))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(rows, f, indent=2)
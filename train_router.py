@@ -0,0 +1,182 @@
+"""
+Train the learned router in main.py (RoutingModel) from recorded traces.
+
+Usage:
+    python train_router.py collect traces.jsonl [--backend stub]
+    python train_router.py train traces.jsonl [--out router.json]
+
+`collect` runs every benchmark case (and each decomposed sub-query) through
+generate_cactus and generate_cloud and records both outputs. `train` fits a
+logistic regression on router_features -> "local output was correct", then
+picks the acceptance threshold that maximizes compute_total_score on the
+recorded cases, routed the way generate_hybrid routes them (fast path first,
+multi-intent cases per sub-query, accept_local's schema gates), and writes
+both to router.json. main.py loads it on first use; until it exists, the
+"learned" router falls back to the confidence threshold.
+"""
+
+import argparse, json, math
+
+import main
+from benchmark import _call_matches, compute_f1, compute_total_score, load_benchmarks, use_backend
+
+
+def _all_correct(predicted, expected):
+    """Every predicted call matches some expected call (precision 1), and there is at least one."""
+    return bool(predicted) and all(any(_call_matches(p, e) for e in expected) for p in predicted)
+
+
+def _trace(case, unit, messages):
+    local = main.generate_cactus(messages, case["tools"])
+    cloud = main.generate_cloud(messages, case["tools"])
+    return {
+        "case": case["name"],
+        "difficulty": case["difficulty"],
+        "unit": unit,
+        "messages": messages,
+        "tools": case["tools"],
+        "expected": case["expected_calls"],
+        "local": local,
+        "cloud": cloud,
+    }
+
+
+def collect(path, cases=None):
+    """Record local and cloud outputs for every case and decomposed sub-query into a JSONL file."""
+    cases = cases or load_benchmarks()
+    with open(path, "w") as f:
+        for i, case in enumerate(cases, 1):
+            print(f"[{i}/{len(cases)}] {case['name']}", flush=True)
+            f.write(json.dumps(_trace(case, "case", case["messages"])) + "\n")
+            subqueries = main.decompose_query(main._last_user_text(case["messages"]))
+            if len(subqueries) > 1:
+                for q in subqueries:
+                    messages = case["messages"][:-1] + [{"role": "user", "content": q}]
+                    f.write(json.dumps(_trace(case, "subquery", messages)) + "\n")
+
+
+def load_traces(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _label(trace):
+    predicted = trace["local"]["function_calls"]
+    if trace["unit"] == "case":
+        return float(compute_f1(predicted, trace["expected"]) == 1.0)
+    return float(_all_correct(predicted, trace["expected"]))
+
+
+def fit_logistic(rows, labels, l2=0.01, lr=0.5, epochs=2000):
+    """Batch gradient descent on standardized features; returns weights on the raw feature scale."""
+    names = [k for k in rows[0] if k != "bias"]
+    n = len(rows)
+    mean = {k: sum(r[k] for r in rows) / n for k in names}
+    std = {k: math.sqrt(sum((r[k] - mean[k]) ** 2 for r in rows) / n) or 1.0 for k in names}
+    xs = [[(r[k] - mean[k]) / std[k] for k in names] for r in rows]
+    w, b = [0.0] * len(names), 0.0
+    for _ in range(epochs):
+        grad_w, grad_b = [0.0] * len(names), 0.0
+        for x, y in zip(xs, labels):
+            z = b + sum(wi * xi for wi, xi in zip(w, x))
+            err = 1 / (1 + math.exp(-max(-60.0, min(60.0, z)))) - y
+            grad_b += err
+            for j, xj in enumerate(x):
+                grad_w[j] += err * xj
+        b -= lr * grad_b / n
+        w = [wi - lr * (gw / n + l2 * wi) for wi, gw in zip(w, grad_w)]
+    weights = {k: wi / std[k] for k, wi in zip(names, w)}
+    weights["bias"] = b - sum(wi * mean[k] / std[k] for k, wi in zip(names, w))
+    return weights
+
+
+def _accepts(trace, model, threshold):
+    """accept_local's decision for a recorded local output, with the router at this threshold."""
+    local = trace["local"]
+    if not local["function_calls"] or not local.get("schema_valid", True):
+        return False
+    return model.score(main.router_features(trace["messages"], trace["tools"], local)) >= threshold
+
+
+def _route(trace, model, threshold):
+    """(calls, ms, stayed local) for one unit the way generate_hybrid routes it: the fast path if it
+    answers, else the recorded local output if accepted, else the recorded cloud one after it."""
+    if main.CONFIG["fast_path"]:
+        fast = main.fast_path(trace["messages"], trace["tools"])
+        if fast is not None:
+            return fast["function_calls"], fast["total_time_ms"], True
+    local, cloud = trace["local"], trace["cloud"]
+    if _accepts(trace, model, threshold):
+        return local["function_calls"], local["total_time_ms"], True
+    return cloud["function_calls"], local["total_time_ms"] + cloud["total_time_ms"], False
+
+
+def _simulate(traces, model, threshold):
+    """Benchmark-style results for the recorded cases if the router had used this threshold.
+
+    Mirrors _route and _route_decomposed: a case the fast path answers never
+    reaches a model, a multi-intent case is routed per recorded sub-query
+    (merged calls, the slowest local plus the slowest fallback, on-device only
+    if every sub-query stayed local), and anything else as a whole.
+    """
+    subqueries = {}
+    for t in traces:
+        if t["unit"] == "subquery":
+            subqueries.setdefault(t["case"], []).append(t)
+    results = []
+    for t in traces:
+        if t["unit"] != "case":
+            continue
+        fast = main.CONFIG["fast_path"] and main.fast_path(t["messages"], t["tools"])
+        parts = subqueries.get(t["case"]) if main.CONFIG["decompose"] and not fast else None
+        if parts:
+            routed = [_route(p, model, threshold) for p in parts]
+            predicted = [call for calls, _, _ in routed for call in calls]
+            local_ms = max(p["local"]["total_time_ms"] for p in parts)
+            cloud_ms = max([p["cloud"]["total_time_ms"] for p, (_, _, kept) in zip(parts, routed) if not kept] or [0.0])
+            time_ms, on_device = local_ms + cloud_ms, all(kept for _, _, kept in routed)
+        else:
+            predicted, time_ms, on_device = _route(t, model, threshold)
+        results.append({"difficulty": t["difficulty"], "f1": compute_f1(predicted, t["expected"]),
+                        "total_time_ms": time_ms, "source": "on-device" if on_device else "cloud"})
+    return results
+
+
+def train(path, out=main.ROUTER_PATH):
+    """Fit weights on all traces, tune the threshold on whole cases as generate_hybrid routes them, and write router.json."""
+    traces = load_traces(path)
+    rows = [main.router_features(t["messages"], t["tools"], t["local"]) for t in traces]
+    labels = [_label(t) for t in traces]
+    weights = fit_logistic(rows, labels)
+    model = main.RoutingModel(weights, 0.5)
+
+    candidates = sorted({0.0, 1.0} | {model.score(r) for r in rows})
+    best_threshold, best_score = 0.5, -1.0
+    for threshold in candidates:
+        score = compute_total_score(_simulate(traces, model, threshold))
+        if score > best_score:
+            best_threshold, best_score = threshold, score
+
+    with open(out, "w") as f:
+        json.dump({"weights": weights, "threshold": best_threshold, "trained_on": len(traces)}, f, indent=2)
+    print(f"Trained on {len(traces)} traces ({int(sum(labels))} local-correct).")
+    print(f"Threshold {best_threshold:.3f} -> simulated score {best_score:.1f}%  (written to {out})")
+    return weights, best_threshold
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect routing traces and train main.py's learned router")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_collect = sub.add_parser("collect", help="Record local/cloud outputs for the benchmark cases")
+    p_collect.add_argument("path")
+    p_collect.add_argument("--backend", choices=["cactus", "stub"], default="cactus")
+    p_train = sub.add_parser("train", help="Fit the router on recorded traces")
+    p_train.add_argument("path")
+    p_train.add_argument("--out", default=main.ROUTER_PATH)
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        use_backend(args.backend)
+        collect(args.path)
+    else:
+        train(args.path, args.out)
@@ -0,0 +1,165 @@
+"""
+Sweep main.py's routing and generation knobs, score each configuration with
+compute_total_score, and report the Pareto frontier of F1, latency and
+on-device ratio.
+
+Usage:
+    python tune.py --backend stub --workers 4
+    python tune.py --replay runs/live.jsonl.gz --grid grid.json --samples 50 --out tune.json
+    python tune.py --cases cases.jsonl.gz --workers 8          # a synth.py corpus instead of the benchmark cases
+
+A grid maps CONFIG keys (plus generate_hybrid's confidence_threshold) to the
+values to try; --samples evaluates a random subset of it instead of every
+combination. Configurations that agree on every GENERATION_KNOBS value are
+evaluated together in one worker over a memo of backend responses
+(recordings.CachingLocalBackend), so each distinct local and cloud request is
+generated once per group and routing-only variants cost almost nothing.
+The stubs don't sleep here; their reported latencies are what gets scored.
+"""
+
+import argparse, itertools, json, random
+
+import main
+from benchmark import _run_case, compute_total_score, load_benchmarks, use_backend
+
+DEFAULT_GRID = {
+    "confidence_threshold": [0.7, 0.85, 0.95, 0.99],
+    "router": ["learned", "threshold"],
+    "speculate_min_prior": [0.3, 0.5, 0.7],
+    "max_tokens": [128, 256],
+    "tool_rag_top_k": [None, 0],
+    "cactus_confidence_threshold": [None, 0.0],
+    "temperature": [None, 0.0],
+}
+
+# Knobs that change what the models are asked or how far they decode.
+GENERATION_KNOBS = (
+    "max_tokens", "token_budget", "token_budget_slack", "token_budget_min", "tool_rag_top_k",
+    "cactus_confidence_threshold", "temperature", "stream", "stream_max_junk_chars", "tool_filter_min_tools",
+    "tool_filter_top_k", "prefix_cache",
+)
+
+
+def expand_grid(grid, samples=None, seed=0):
+    """Every combination of grid values as a list of configs, or a seeded random sample of them."""
+    keys = sorted(grid)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    if samples and samples < len(configs):
+        configs = random.Random(seed).sample(configs, samples)
+    return configs
+
+
+def _generation_key(config):
+    return json.dumps({k: config[k] for k in GENERATION_KNOBS if k in config}, sort_keys=True)
+
+
+def evaluate(config, cases):
+    """Run every case under config and summarize the results."""
+    overrides = {k: v for k, v in config.items() if k != "confidence_threshold"}
+    saved = {k: main.CONFIG[k] for k in overrides}
+    main.CONFIG.update(overrides)
+    main.response_cache.clear()
+    main.get_cloud_dispatcher().clear_recent()
+    try:
+        results = [_run_case(case, config.get("confidence_threshold", 0.99)) for case in cases]
+    finally:
+        main.CONFIG.update(saved)
+    n = len(results)
+    return {
+        "config": config,
+        "score": compute_total_score(results),
+        "f1": sum(r["f1"] for r in results) / n,
+        "avg_time_ms": sum(r["total_time_ms"] for r in results) / n,
+        "on_device": sum(r["source"] == "on-device" for r in results) / n,
+    }
+
+
+_cases = None
+
+
+def _init_worker(backend):
+    global _cases
+    use_backend(*backend)
+    _cases = load_benchmarks()
+
+
+def _evaluate_group(configs):
+    """Evaluate configs that share generation settings over one response memo."""
+    from recordings import CachingCloudBackend, CachingLocalBackend, RecordingStore
+    local, cloud = main.get_local_backend(), main.get_cloud_backend()
+    store = RecordingStore()
+    main.set_backends(local=CachingLocalBackend(local, store), cloud=CachingCloudBackend(cloud, store))
+    try:
+        return [evaluate(config, _cases) for config in configs]
+    finally:
+        main.set_backends(local=local, cloud=cloud)
+
+
+def pareto_frontier(rows):
+    """Rows no other row beats on F1, average latency and on-device ratio at once."""
+    def dominates(a, b):
+        at_least = a["f1"] >= b["f1"] and a["avg_time_ms"] <= b["avg_time_ms"] and a["on_device"] >= b["on_device"]
+        better = a["f1"] > b["f1"] or a["avg_time_ms"] < b["avg_time_ms"] or a["on_device"] > b["on_device"]
+        return at_least and better
+
+    return [r for r in rows if not any(dominates(other, r) for other in rows)]
+
+
+def tune(grid=None, backend=("stub",), workers=1, samples=None, seed=0):
+    """Evaluate the grid, grouped by generation settings; returns rows sorted by score."""
+    configs = expand_grid(grid or DEFAULT_GRID, samples, seed)
+    groups = {}
+    for config in configs:
+        groups.setdefault(_generation_key(config), []).append(config)
+    print(f"Evaluating {len(configs)} configurations in {len(groups)} generation groups...", flush=True)
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(backend,)) as pool:
+            grouped = list(pool.map(_evaluate_group, groups.values()))
+    else:
+        _init_worker(backend)
+        grouped = [_evaluate_group(group) for group in groups.values()]
+    return sorted((row for rows in grouped for row in rows), key=lambda r: -r["score"])
+
+
+def _print_rows(title, rows):
+    print(f"\n--- {title} ---")
+    print(f"  {'score':>6}  {'F1':>5}  {'avg ms':>8}  {'local':>6}  config")
+    for r in rows:
+        print(f"  {r['score']:>6.1f}  {r['f1']:>5.2f}  {r['avg_time_ms']:>8.1f}  {r['on_device']:>6.0%}  {json.dumps(r['config'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep routing/generation knobs and report the Pareto frontier")
+    parser.add_argument("--backend", choices=["cactus", "stub"], default="stub")
+    parser.add_argument("--replay", metavar="PATH", help="Score against responses recorded with benchmark.py --record")
+    parser.add_argument("--grid", metavar="JSON", help="File mapping knobs to lists of values (default: DEFAULT_GRID)")
+    parser.add_argument("--samples", type=int, help="Evaluate this many random grid points instead of all of them")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", metavar="PATH", help="Tune on a corpus generated by synth.py")
+    parser.add_argument("--top", type=int, default=10, help="Best configurations to list")
+    parser.add_argument("--out", metavar="PATH", help="Write every evaluated configuration and the frontier as JSON")
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    unknown = set(grid) - set(main.CONFIG) - {"confidence_threshold"}
+    if unknown:
+        parser.error(f"unknown knobs in grid: {', '.join(sorted(unknown))}")
+
+    if args.replay:
+        backend = ("replay", args.replay, args.seed, None, args.cases)
+    else:
+        backend = (args.backend, None, args.seed, False, args.cases)
+    rows = tune(grid, backend, args.workers, args.samples, args.seed)
+    frontier = pareto_frontier(rows)
+    _print_rows(f"Top {min(args.top, len(rows))} by total score", rows[:args.top])
+    _print_rows(f"Pareto frontier (F1 / latency / on-device), {len(frontier)} configurations", frontier)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"results": rows, "frontier": frontier}, f, indent=2)
+        print(f"\nWritten to {args.out}")
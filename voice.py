@@ -0,0 +1,192 @@
+"""
+Voice-to-action: a WAV command in, tool calls out, with transcription and
+routing overlapped.
+
+Usage:
+    from voice import voice_to_action
+    result = voice_to_action("command.wav", tools)
+
+    python voice.py fixtures voice_fixtures          # tone-coded WAVs of the benchmark queries (stub backend)
+    python benchmark.py --voice voice_fixtures --backend stub
+
+While audio arrives, the pipeline re-transcribes everything heard so far on a
+resident Whisper handle, every chunk_ms. Once a partial transcript looks
+final (two in a row agree, or Whisper closed the sentence), generate_hybrid
+starts on that text: cache lookup, tool pre-filtering, local generation and any speculative
+cloud call. If the final transcript matches, that result is used as is;
+otherwise it is cancelled and the final text is routed instead. When all
+the audio after the last partial is silence, that partial is the final
+transcript and Whisper is not run again.
+"""
+
+import asyncio, atexit, json, os, tempfile, threading, time, wave
+
+import main
+
+whisper_path = "cactus/weights/whisper-small"
+WHISPER_PROMPT = "<|startoftranscript|><|en|><|transcribe|><|notimestamps|>"
+
+_whisper_pool = None
+_whisper_pool_lock = threading.Lock()
+
+
+def get_whisper_pool(size=None):
+    """Return the shared pool of resident Whisper handles, sized like get_model_pool ($WHISPER_POOL_SIZE)."""
+    global _whisper_pool
+    with _whisper_pool_lock:
+        if _whisper_pool is None:
+            _whisper_pool = main.ModelPool(whisper_path, size or int(os.environ.get("WHISPER_POOL_SIZE", "1")))
+            atexit.register(_whisper_pool.close)
+        elif size and size > _whisper_pool.size:
+            _whisper_pool.size = size
+        return _whisper_pool
+
+
+def transcribe(audio_path):
+    """Transcript of a WAV file on a pooled Whisper handle."""
+    with main.stage("transcribe"):
+        with get_whisper_pool().handle() as model:
+            raw = json.loads(main.get_local_backend().transcribe(model, audio_path, WHISPER_PROMPT))
+    return (raw.get("response") or "").strip()
+
+
+def _prepare(tools):
+    """Build the per-catalog state routing needs while the user is still talking."""
+    main.validator_for(tools)
+    if len(tools) > main.CONFIG["tool_filter_min_tools"]:
+        main.tool_index_for(tools)
+
+
+def voice_to_action(audio_path, tools, chunk_ms=500, realtime=True, stream=True, confidence_threshold=0.99):
+    """Transcribe a spoken command and route it through generate_hybrid.
+
+    With realtime, the file is treated as arriving at its natural pace from the
+    moment of the call, as from a microphone; stream=False waits for the whole
+    recording and transcribes it once. On top of generate_hybrid's fields the
+    result has "transcript", "partials", "speculated" and "latency_ms", the time
+    from the last audio arriving to the tool calls being ready.
+    """
+    return main._run_sync(_voice(audio_path, tools, chunk_ms, realtime, stream, confidence_threshold))
+
+
+async def voice_to_action_async(audio_path, tools, chunk_ms=500, realtime=True, stream=True, confidence_threshold=0.99):
+    """Async voice_to_action; cancelling it cancels any routing in flight."""
+    return await main._on_engine(_voice(audio_path, tools, chunk_ms, realtime, stream, confidence_threshold))
+
+
+def _silent(pcm, sample_width, threshold=500):
+    """True if 16-bit PCM never rises above threshold (about -36 dBFS); other formats never count as silent."""
+    if sample_width != 2 or not pcm:
+        return False
+    from array import array
+    samples = array("h", pcm)
+    return max(samples) < threshold and -min(samples) < threshold
+
+
+def _user(text):
+    return [{"role": "user", "content": text}]
+
+
+async def _voice(audio_path, tools, chunk_ms, realtime, stream, confidence_threshold):
+    with main.tracing("voice_to_action") as trace:
+        result = await _listen(audio_path, tools, chunk_ms, realtime, stream, confidence_threshold)
+    if trace is not None:
+        result["stages"] = trace.stages()
+    return result
+
+
+async def _listen(audio_path, tools, chunk_ms, realtime, stream, confidence_threshold):
+    with wave.open(audio_path, "rb") as f:
+        params = f.getparams()
+        frames = f.readframes(params.nframes)
+    rate, total = params.framerate, params.nframes
+    if total == 0:
+        # Nothing was said: an empty transcript asks for no calls.
+        return {"function_calls": [], "total_time_ms": 0.0, "confidence": 1.0, "source": "on-device",
+                "speculated": False, "transcript": "", "partials": [], "latency_ms": 0.0}
+    frame_bytes = params.sampwidth * params.nchannels
+    chunk = max(1, rate * chunk_ms // 1000)
+    whisper_workers = get_whisper_pool().size
+    start_time = time.time()
+
+    partials, speculation = [], None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            if stream:
+                await main._in_thread("local", main.get_model_pool().size, _prepare, tools)
+            heard = 0
+            while heard < total:
+                target = min(total, heard + chunk) if stream else total
+                if realtime:
+                    await asyncio.sleep(max(0.0, start_time + target / rate - time.time()))
+                    heard = max(target, min(total, int((time.time() - start_time) * rate)))
+                else:
+                    heard = target
+                if heard == total and partials and _silent(frames[partial_end * frame_bytes:], params.sampwidth):
+                    break
+                if heard < total:
+                    path = os.path.join(tmp, f"partial-{heard}.wav")
+                    with wave.open(path, "wb") as f:
+                        f.setparams(params)
+                        f.writeframes(frames[:heard * frame_bytes])
+                else:
+                    path = audio_path
+                text = await main._in_thread("whisper", whisper_workers, transcribe, path)
+                if heard == total:
+                    break
+                partials.append({"audio_ms": heard * 1000 / rate, "text": text,
+                                 "at_ms": (time.time() - start_time) * 1000})
+                partial_end = heard
+                key = main.normalize_query(text)
+                stable = text.endswith((".", "?", "!")) or (
+                    len(partials) > 1 and main.normalize_query(partials[-2]["text"]) == key)
+                if key and stable and (speculation is None or speculation[0] != key):
+                    if speculation is not None:
+                        speculation[1].cancel()
+                    speculation = (key, asyncio.ensure_future(main._hybrid(_user(text), tools, confidence_threshold)))
+
+        if speculation is not None and speculation[0] == main.normalize_query(text):
+            result = await speculation[1]
+            result["speculated"] = True
+        else:
+            if speculation is not None:
+                speculation[1].cancel()
+            result = await main._hybrid(_user(text), tools, confidence_threshold)
+            result["speculated"] = False
+    except BaseException:
+        if speculation is not None:
+            speculation[1].cancel()
+        raise
+
+    audio_end = start_time + total / rate if realtime else start_time
+    result["transcript"] = text
+    result["partials"] = partials
+    result["latency_ms"] = (time.time() - audio_end) * 1000
+    return result
+
+
+def write_fixtures(directory, cases=None):
+    """Write <case name>.wav for each benchmark case, speaking its query in stub_backend's tone code."""
+    from benchmark import load_benchmarks
+    from stub_backend import TONE_RATE, encode_tones
+    os.makedirs(directory, exist_ok=True)
+    cases = cases or load_benchmarks()
+    for case in cases:
+        with wave.open(os.path.join(directory, f"{case['name']}.wav"), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(TONE_RATE)
+            f.writeframes(encode_tones(main._last_user_text(case["messages"])).tobytes())
+    return len(cases)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Voice-to-action pipeline utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_fixtures = sub.add_parser("fixtures", help="Write tone-coded WAV fixtures of the benchmark queries")
+    p_fixtures.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "fixtures":
+        print(f"Wrote {write_fixtures(args.directory)} fixtures to {args.directory}")